@@ -0,0 +1,88 @@
+"""Local stand-in for the Telegram Bot API.
+
+Answers every `/bot<token>/<method>` call with a plausible `{"ok": true}` payload, so
+`bot.send_*`, `edit_message_text`, `get_chat_member` etc. work without the network.
+Calls are counted per method and message texts are kept, so the bench can wait for
+"Backup Report" / "Broadcast Complete" and measure end-to-end command time.
+"""
+import json, threading, time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MESSAGE_METHODS = {"sendMessage", "sendPhoto", "sendDocument", "editMessageText", "forwardMessage", "copyMessage"}
+
+
+class FakeTelegram:
+    def __init__(self, port=0, latency_ms=0):
+        self.latency = latency_ms / 1000
+        self.calls = Counter()
+        self.texts = deque(maxlen=2000)
+        self.bytes_in = 0
+        self._msg_id = 0
+        self._cond = threading.Condition()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self): self._handle()
+            def do_POST(self): self._handle()
+
+            def _handle(self):
+                url = urlparse(self.path)
+                method = url.path.rstrip("/").rsplit("/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                    params.update({k: v[0] for k, v in parse_qs(body.decode("utf-8", "replace")).items()})
+                payload = json.dumps({"ok": True, "result": fake.result(method, params, len(body))}).encode()
+                if fake.latency: time.sleep(fake.latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args): pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.api_url = f"http://127.0.0.1:{self.port}/bot{{0}}/{{1}}"
+        self.file_url = f"http://127.0.0.1:{self.port}/file/bot{{0}}/{{1}}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def result(self, method, params, nbytes):
+        with self._cond:
+            self.calls[method] += 1
+            self.bytes_in += nbytes
+            self._msg_id += 1
+            msg_id = self._msg_id
+            if "text" in params or "caption" in params:
+                self.texts.append((time.time(), method, params.get("text") or params.get("caption")))
+            self._cond.notify_all()
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getChatMember":
+            return {"status": "member", "user": {"id": int(params.get("user_id", 1)), "is_bot": False, "first_name": "U"}}
+        if method in MESSAGE_METHODS:
+            chat_id = params.get("chat_id", "1")
+            return {"message_id": msg_id, "date": int(time.time()), "text": params.get("text", ""),
+                    "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 1, "type": "private"}}
+        return True
+
+    def wait_for_text(self, needle, since, timeout):
+        """Block until a sent/edited message containing `needle` shows up after `since`."""
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                for ts, _, text in self.texts:
+                    if ts >= since and text and needle in text: return ts
+                left = deadline - time.time()
+                if left <= 0: return None
+                self._cond.wait(left)
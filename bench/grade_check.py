@@ -0,0 +1,57 @@
+"""Closed-form grade solver ko purane level-by-level loop se match karo, phir speed compare.
+
+    python -m bench.grade_check            # exhaustive 0..200k + random bade/float/negative xp
+Exit code 1 agar koi bhi value alag nikle.
+"""
+import os, random, sys, time
+
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH-TOKEN")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import quiz
+
+
+def reference_grade_stats(xp):
+    # Purana implementation, jaisa tha
+    level = 1; cost = 100; temp_xp = xp
+    while temp_xp >= cost:
+        temp_xp -= cost; level += 1; cost += 20
+    percent = (temp_xp / cost) * 100
+    return {"grade": level, "current_xp": temp_xp, "req_xp": cost, "percent": min(percent, 100)}
+
+
+def same(a, b):
+    return (a["grade"] == b["grade"] and a["req_xp"] == b["req_xp"]
+            and abs(a["current_xp"] - b["current_xp"]) < 1e-6 and abs(a["percent"] - b["percent"]) < 1e-9)
+
+
+def main():
+    rng = random.Random(23)
+    xps = list(range(0, 200_001))
+    xps += [rng.randrange(10 ** 6, 10 ** 10) for _ in range(2_000)]
+    xps += [rng.uniform(-500, 10 ** 6) for _ in range(5_000)]
+    # Har level boundary aur uske aas-paas
+    xps += [10 * k * k + 90 * k + d for k in range(0, 5_000, 7) for d in (-1, 0, 1)]
+    bad = [x for x in xps if not same(quiz.calculate_grade_stats(x), reference_grade_stats(x))]
+
+    ints = [x for x in xps if isinstance(x, int)]
+    batch = quiz.grade_stats_batch(ints)
+    bad_batch = [x for x, got in zip(ints, batch) if not same(got, reference_grade_stats(x))]
+
+    sample = [rng.randrange(0, 10 ** 7) for _ in range(2_000)]
+    timings = {}
+    for name, fn in (("loop", lambda: [reference_grade_stats(x) for x in sample]),
+                     ("closed_form", lambda: [quiz.calculate_grade_stats(x) for x in sample]),
+                     ("batch", lambda: quiz.grade_stats_batch(sample))):
+        t0 = time.perf_counter(); fn()
+        timings[name] = (time.perf_counter() - t0) * 1e6 / len(sample)
+
+    print(f"checked {len(xps)} scalar + {len(ints)} batch values (numpy: {'yes' if quiz.get_numpy() is not None else 'no'})")
+    print("per call: " + " | ".join(f"{k} {v:.2f} µs" for k, v in timings.items()))
+    if bad or bad_batch:
+        print(f"❌ mismatches: scalar {bad[:5]} batch {bad_batch[:5]}")
+        sys.exit(1)
+    print("✅ closed form == loop")
+
+
+if __name__ == "__main__":
+    main()
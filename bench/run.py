@@ -0,0 +1,281 @@
+"""Reproducible load/benchmark run for quiz.py.
+
+    pip install -r bench/requirements.txt
+    python -m bench.run --scale 1k                        # mongomock, sab phases
+    python -m bench.run --scale 100k --mongo mongodb://localhost:27017/ --json out.json
+    python -m bench.run --scale 1k --baseline out.json    # p50/p99/throughput regression check
+
+The app runs in a child process (bench.server) against mongomock or a local mongod, with
+the Telegram Bot API replaced by bench.fake_telegram. HTTP endpoints are driven by N
+concurrent clients, battles by pairs of Socket.IO clients, and /broadcast + /backup are
+sent as webhook updates. Per phase: throughput, latency percentiles, errors and the
+server's peak RSS (VmHWM, reset between phases via /proc/<pid>/clear_refs).
+
+mongomock pipeline-update/$merge support adhoora hai; exact numbers ke liye local mongod use karo.
+"""
+import argparse, json, os, random, subprocess, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.fake_telegram import FakeTelegram
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# --- measurement helpers ---
+def percentile(sorted_ms, q):
+    if not sorted_ms: return 0.0
+    return round(sorted_ms[min(len(sorted_ms) - 1, int(q * len(sorted_ms)))], 2)
+
+
+def proc_status(pid):
+    out = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(("VmHWM", "VmRSS")):
+                key, val = line.split(":")
+                out[key] = int(val.split()[0]) // 1024  # MB
+    return out
+
+
+def reset_peak(pid):
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f: f.write("5")  # VmHWM = current RSS
+    except OSError:
+        pass  # Purana kernel / permission nahi: peak poore run ka rahega
+
+
+class Phase:
+    def __init__(self, name):
+        self.name, self.lat, self.errors, self.lock = name, [], 0, threading.Lock()
+
+    def record(self, ms, ok=True):
+        with self.lock:
+            self.lat.append(ms)
+            if not ok: self.errors += 1
+
+    def fail(self):
+        with self.lock: self.errors += 1
+
+    def summary(self, secs, pid):
+        lat = sorted(self.lat)
+        mem = proc_status(pid)
+        return {"phase": self.name, "requests": len(lat), "errors": self.errors,
+                "rps": round(len(lat) / max(secs, 1e-6), 1), "p50_ms": percentile(lat, 0.5),
+                "p90_ms": percentile(lat, 0.9), "p99_ms": percentile(lat, 0.99),
+                "max_ms": round(lat[-1], 2) if lat else 0.0, "peak_rss_mb": mem.get("VmHWM"),
+                "secs": round(secs, 2)}
+
+
+# --- HTTP phases ---
+def run_http(base, name, make_request, concurrency, total, pid):
+    phase, local = Phase(name), threading.local()
+
+    def one(i):
+        sess = getattr(local, "s", None) or requests.Session()
+        local.s = sess
+        method, path, body = make_request(i)
+        t0 = time.perf_counter()
+        try:
+            r = sess.request(method, base + path, json=body, timeout=60, headers={"Accept-Encoding": "gzip, br"})
+            ok = r.status_code < 400 and "error" not in (r.text[:200] if r.headers.get("Content-Type", "").startswith("application/json") else "")
+        except requests.RequestException:
+            ok = False
+        phase.record((time.perf_counter() - t0) * 1000, ok)
+
+    reset_peak(pid)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool: list(pool.map(one, range(total)))
+    return phase.summary(time.perf_counter() - t0, pid)
+
+
+def http_phases(info, rng):
+    chapters, users = info["chapters"], info["users"]
+    uid = lambda: str(100000 + rng.randrange(users))
+
+    def chapter(i):
+        src, typ, chap = rng.choice(chapters)
+        return "GET", f"/api/chapter?source={src}&type={typ}&chapter={chap}&page=1", None
+
+    def sync(i):
+        q = {"q": f"bench mistake {rng.randrange(1000)}", "opts": ["a", "b", "c", "d"], "ans": 1, "diff": "EASY"}
+        return "POST", "/api/user/sync", {"id": uid(), "name": "Bench", "add_score": rng.randint(0, 40),
+                                          "mistakes": [q] if i % 3 == 0 else [], "solved": []}
+
+    return [
+        ("get_index", lambda i: ("GET", "/api/get_index", None)),
+        ("chapter", chapter),
+        ("get_data", lambda i: ("GET", "/api/get_data", None)),
+        ("sync", sync),
+        ("leaderboard_daily", lambda i: ("GET", f"/api/leaderboard/daily?uid={uid()}", None)),
+        ("leaderboard_weekly", lambda i: ("GET", f"/api/leaderboard/weekly?uid={uid()}", None)),
+        ("leaderboard_all", lambda i: ("GET", f"/api/leaderboard/all?uid={uid()}", None)),
+        ("user_mistakes", lambda i: ("GET", f"/api/user/mistakes?uid={uid()}&page=1", None)),
+    ]
+
+
+# --- Socket.IO battles ---
+def run_battles(base, pairs, questions, chapter, pid):
+    import socketio as sio_client
+    phase, done = Phase("battle_answer_rtt"), threading.Semaphore(0)
+
+    def player(room_box, ready):
+        c = sio_client.Client(reconnection=False)
+        sent = {}
+
+        @c.on("room_created")
+        def created(data):
+            room_box["id"] = data["room_id"]; ready.set()
+
+        @c.on("battle_question")
+        def question(q):
+            sent[q["idx"]] = time.perf_counter()
+            c.emit("submit_answer", {"room_id": room_box["id"], "idx": q["idx"], "choice": random.randint(0, 3)})
+
+        @c.on("answer_result")
+        def result(data):
+            t0 = sent.pop(data["idx"], None)
+            if t0: phase.record((time.perf_counter() - t0) * 1000)
+
+        @c.on("battle_over")
+        def over(data):
+            done.release(); c.disconnect()
+
+        @c.on("error")
+        def error(data):
+            phase.fail()
+
+        c.connect(base, transports=["websocket", "polling"])
+        return c
+
+    reset_peak(pid)
+    t0 = time.perf_counter()
+    for n in range(pairs):
+        box, ready = {}, threading.Event()
+        host = player(box, ready)
+        host.emit("create_room", {"uid": f"h{n}", "name": f"Host {n}", "chapters": [chapter], "count": questions,
+                                 "timer": 5})
+        if not ready.wait(10):
+            phase.fail(); continue
+        guest = player(box, ready)
+        guest.emit("join_room_request", {"room_id": box["id"], "uid": f"g{n}", "name": f"Guest {n}"})
+        time.sleep(0.05)
+        host.emit("start_game", {"room_id": box["id"]})
+    finished = sum(done.acquire(timeout=questions * 10 + 30) for _ in range(pairs * 2))
+    summary = phase.summary(time.perf_counter() - t0, pid)
+    summary["battles_finished"] = finished // 2
+    return summary
+
+
+# --- Bot commands via webhook ---
+def run_command(base, tg, info, text, needle, pid, timeout):
+    reset_peak(pid)
+    update = {"update_id": random.randint(1, 10 ** 9),
+              "message": {"message_id": 1, "date": int(time.time()), "text": text,
+                          "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+                          "chat": {"id": info["admin_id"], "type": "private"},
+                          "from": {"id": info["admin_id"], "is_bot": False, "first_name": "Admin"}}}
+    before = dict(tg.calls)
+    t0 = time.time()
+    r = requests.post(f"{base}/telegram/webhook/bench", json=update,
+                      headers={"X-Telegram-Bot-Api-Secret-Token": "bench"}, timeout=10)
+    ended = tg.wait_for_text(needle, t0, timeout) if r.ok else None
+    secs = (ended or time.time()) - t0
+    calls = {k: v - before.get(k, 0) for k, v in tg.calls.items() if v - before.get(k, 0)}
+    return {"phase": text.split()[0].lstrip("/"), "requests": 1, "errors": 0 if ended else 1, "rps": 0,
+            "p50_ms": round(secs * 1000), "p90_ms": round(secs * 1000), "p99_ms": round(secs * 1000),
+            "max_ms": round(secs * 1000), "peak_rss_mb": proc_status(pid).get("VmHWM"), "secs": round(secs, 2),
+            "telegram_calls": calls}
+
+
+# --- report ---
+def print_table(rows):
+    cols = ["phase", "requests", "errors", "rps", "p50_ms", "p90_ms", "p99_ms", "max_ms", "peak_rss_mb"]
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in cols}
+    print("  ".join(c.ljust(widths[c]) for c in cols))
+    for r in rows: print("  ".join(str(r.get(c, "")).ljust(widths[c]) for c in cols))
+
+
+def compare(rows, baseline_path, tolerance):
+    base = {r["phase"]: r for r in json.load(open(baseline_path))["phases"]}
+    regressions = []
+    for r in rows:
+        b = base.get(r["phase"])
+        if not b: continue
+        for key in ("p50_ms", "p99_ms"):
+            if b[key] and r[key] > b[key] * (1 + tolerance): regressions.append(f"{r['phase']} {key}: {b[key]} -> {r[key]}")
+        if b["rps"] and r["rps"] < b["rps"] * (1 - tolerance): regressions.append(f"{r['phase']} rps: {b['rps']} -> {r['rps']}")
+        if b.get("peak_rss_mb") and r.get("peak_rss_mb") and r["peak_rss_mb"] > b["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{r['phase']} peak_rss_mb: {b['peak_rss_mb']} -> {r['peak_rss_mb']}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scale", default="1k", help="1k | 100k | 1m | koi bhi number")
+    ap.add_argument("--mongo", default="mongomock")
+    ap.add_argument("--port", type=int, default=5055)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--requests", type=int, default=500, help="har HTTP phase me requests")
+    ap.add_argument("--battles", type=int, default=10, help="ek saath chalne wali 1v1 battles")
+    ap.add_argument("--battle-questions", type=int, default=5)
+    ap.add_argument("--tg-latency-ms", type=float, default=30, help="fake Telegram API ka simulated latency")
+    ap.add_argument("--async-mode", default="eventlet", choices=["eventlet", "threading"])
+    ap.add_argument("--only", default="", help="comma list of phases (default: sab)")
+    ap.add_argument("--json", help="result JSON yahan likho")
+    ap.add_argument("--baseline", help="purani --json file se compare; regression par exit 1")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args()
+
+    tg = FakeTelegram(latency_ms=args.tg_latency_ms).start()
+    server = subprocess.Popen([sys.executable, "-m", "bench.server", "--port", str(args.port), "--scale", args.scale,
+                               "--mongo", args.mongo, "--telegram-url", tg.api_url, "--telegram-file-url", tg.file_url,
+                               "--async-mode", args.async_mode], cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    try:
+        info = None
+        for line in server.stdout:
+            if line.startswith("READY "):
+                info = json.loads(line[6:]); break
+            print(line, end="")
+        if not info: sys.exit("bench server did not start")
+        threading.Thread(target=lambda: [None for _ in server.stdout], daemon=True).start()  # Pipe bhara na rahe
+        base, pid, rng = f"http://127.0.0.1:{args.port}", server.pid, random.Random(11)
+        for _ in range(100):
+            try:
+                requests.get(base + "/healthz", timeout=1); break
+            except requests.RequestException:
+                time.sleep(0.1)
+        print(f"Seeded {args.scale}: {info['questions']} questions, {info['users']} users, {info['logs']} logs "
+              f"in {info['seed_secs']}s (server pid {pid})\n")
+
+        only = set(filter(None, args.only.split(",")))
+        want = lambda name: not only or name in only
+        rows = []
+        for name, make in http_phases(info, rng):
+            if not want(name): continue
+            # get_data poora bank bhejta hai; bade scale par kam requests
+            total = max(10, args.requests // 20) if name == "get_data" and info["questions"] > 10_000 else args.requests
+            rows.append(run_http(base, name, make, args.concurrency, total, pid))
+        if want("battle"): rows.append(run_battles(base, args.battles, args.battle_questions, info["chapters"][0], pid))
+        if want("broadcast"): rows.append(run_command(base, tg, info, "/broadcast bench announcement", "Broadcast Complete", pid, 3600))
+        if want("backup"): rows.append(run_command(base, tg, info, "/backup", "Backup Report", pid, 3600))
+
+        print_table(rows)
+        result = {"scale": args.scale, "mongo": "mongomock" if args.mongo == "mongomock" else "mongod",
+                  "async_mode": args.async_mode, "concurrency": args.concurrency, "ts": time.time(), "phases": rows}
+        if args.json:
+            with open(args.json, "w") as f: json.dump(result, f, indent=2)
+        if args.baseline:
+            regressions = compare(rows, args.baseline, args.tolerance)
+            if regressions:
+                print("\n❌ Regressions:\n  " + "\n  ".join(regressions))
+                sys.exit(1)
+            print("\n✅ No regressions vs baseline")
+    finally:
+        server.terminate()
+        tg.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Synthetic data for the bench: question bank + chapters, users, mistakes, score logs, boards.
+
+Everything is written through quiz's own collections and helpers (question_id, log_key,
+leaderboard_ops), so the documents have exactly the production shape.
+"""
+import random, time
+from datetime import datetime
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+CHAPTER_SIZE = 500
+BATCH = 5_000
+
+
+def _batches(items, size=BATCH):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch: yield batch
+
+
+def fake_question(i, rng):
+    return {"q": f"Q{i}: Which of the following is true about topic {rng.randint(1, 999)}? <br>{'x' * rng.randint(40, 240)}",
+            "opts": [f"Option {c} for {i}" for c in "ABCD"], "ans": rng.randint(0, 3),
+            "diff": rng.choice(["EASY", "MEDIUM", "HARD"])}
+
+
+def seed(quiz, n, seed_value=7):
+    """Fill the DB with `n` questions, users, mistakes and score logs; returns counts + chapter list."""
+    rng = random.Random(seed_value)
+    now = time.time()
+    for col in (quiz.bank_col, quiz.questions_col, quiz.users_col, quiz.mistakes_col, quiz.logs_col,
+                quiz.boards_col, quiz.rollups_col):
+        col.delete_many({})
+
+    # Bank + chapters (Allen/Botany/Chapter-k, CHAPTER_SIZE qids each)
+    chapters, qids = [], []
+    for batch in _batches(fake_question(i, rng) for i in range(n)):
+        docs = [dict(q, _id=quiz.question_id(q), ts=now) for q in batch]
+        quiz.bank_col.insert_many(docs, ordered=False)
+        qids.extend(d["_id"] for d in docs)
+    chapter_docs = []
+    for k in range(0, len(qids), CHAPTER_SIZE):
+        key = ("Allen", "Botany" if (k // CHAPTER_SIZE) % 2 else "Zoology", f"Chapter {k // CHAPTER_SIZE + 1}")
+        chapters.append(key)
+        chapter_docs.append({"source": key[0], "type": key[1], "chapter": key[2], "part": 0, "mode": "normal",
+                             "qids": qids[k:k + CHAPTER_SIZE]})
+    for batch in _batches(chapter_docs, 500): quiz.questions_col.insert_many(batch)
+
+    # Users (xp long-tail) + kuch mistakes
+    uids = [str(100000 + i) for i in range(n)]
+    for batch in _batches({"_id": uid, "name": f"User {uid}", "xp": int(rng.paretovariate(1.2) * 50),
+                           "mistake_count": 0} for uid in uids):
+        quiz.users_col.insert_many(batch, ordered=False)
+    sample = rng.sample(range(len(qids)), min(len(qids), 200))
+    mistakes = ({"uid": uids[i % len(uids)], "qh": qids[j], "qv": 2, "q": f"Q{j}", "opts": [], "ans": 0,
+                 "diff": "EASY", "ts": now - i} for i, j in enumerate(rng.choice(sample) for _ in range(n)))
+    written = 0
+    for batch in _batches(mistakes):
+        seen, unique = set(), []
+        for m in batch:
+            if (m["uid"], m["qh"]) not in seen:
+                seen.add((m["uid"], m["qh"])); unique.append(m)
+        quiz.mistakes_col.insert_many(unique, ordered=False)
+        written += len(unique)
+
+    # Score logs pichhle 14 din me + unke daily/weekly boards
+    for batch in _batches(range(n)):
+        logs = []
+        for i in batch:
+            uid = uids[rng.randrange(len(uids))]
+            log = {"uid": uid, "name": f"User {uid}", "score": rng.randint(1, 40), "ts": now - rng.random() * 14 * 86400}
+            logs.append(dict(log, _id=quiz.log_key(log), at=datetime.utcfromtimestamp(log["ts"])))
+        quiz.logs_col.insert_many(logs, ordered=False)
+        quiz.boards_col.bulk_write(quiz.leaderboard_ops(logs), ordered=False)
+
+    return {"questions": len(qids), "chapters": chapters, "users": len(uids), "mistakes": written, "logs": n}
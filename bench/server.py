@@ -0,0 +1,49 @@
+"""Bench server process: quiz app wired to a fake Telegram API and mongomock / local mongod.
+
+Run by bench/run.py as a child process (so its RSS can be measured on its own):
+    python -m bench.server --port 5055 --telegram-url http://127.0.0.1:PORT/bot{0}/{1} --scale 1k
+Prints one `READY {json}` line after seeding, then serves until killed.
+"""
+import argparse, json, os, sys, time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--port", type=int, default=5055)
+parser.add_argument("--scale", default="1k")
+parser.add_argument("--mongo", default="mongomock", help="'mongomock' ya mongodb:// URI (e.g. local mongod)")
+parser.add_argument("--telegram-url", required=True)
+parser.add_argument("--telegram-file-url", default=None)
+parser.add_argument("--async-mode", default="eventlet", choices=["eventlet", "threading"])
+args = parser.parse_args()
+
+if args.async_mode == "eventlet":
+    import eventlet
+    eventlet.monkey_patch()  # gunicorn -k eventlet jaisa hi
+
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH-TOKEN")
+os.environ["MONGO_URI"] = args.mongo if args.mongo != "mongomock" else "mongodb://mongomock.invalid/"
+os.environ["MONGO_DB_NAME"] = os.getenv("MONGO_DB_NAME", "neet_bot_bench")
+os.environ["SOCKETIO_ASYNC_MODE"] = args.async_mode
+os.environ.setdefault("WEBHOOK_URL", "http://bench.invalid")  # Updates webhook route se, UpdatePool ke through
+os.environ.setdefault("WEBHOOK_SECRET", "bench")
+os.environ.setdefault("BROADCAST_RATE", "1000")
+os.environ.setdefault("LOG_FLUSH_SECS", "0.5")
+
+import telebot
+telebot.apihelper.API_URL = args.telegram_url
+if args.telegram_file_url: telebot.apihelper.FILE_URL = args.telegram_file_url
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import quiz
+from bench.seed import SCALES, seed
+
+if args.mongo == "mongomock":
+    import mongomock
+    quiz._client = mongomock.MongoClient()
+
+started = time.time()
+info = seed(quiz, SCALES.get(args.scale) or int(args.scale))
+quiz.ensure_indexes()
+info.update(seed_secs=round(time.time() - started, 1), pid=os.getpid(), admin_id=quiz.ADMIN_ID,
+            chapters=info["chapters"][:200])
+print("READY " + json.dumps(info), flush=True)
+quiz.socketio.run(quiz.app, host="127.0.0.1", port=args.port, allow_unsafe_werkzeug=True, log_output=False)
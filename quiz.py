@@ -1,15 +1,33 @@
+import time
+_IMPORT_T0 = time.perf_counter()  # Cold start: import time yahin se naapa jaata hai
+
 import telebot
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, g
 from flask_socketio import SocketIO, emit, join_room, leave_room
 import random, string
 from flask_cors import CORS
-from pymongo import MongoClient
-import threading, os, time
-import certifi 
-import json
-from datetime import datetime
-from fpdf import FPDF
+from pymongo import MongoClient, ReturnDocument, UpdateOne, DeleteMany, ReplaceOne
+from pymongo.errors import BulkWriteError, OperationFailure, DuplicateKeyError
+from pymongo import monitoring
+import threading, os, time, atexit, io, queue, tempfile, bisect, sys
+from concurrent.futures import ThreadPoolExecutor
+import json, hashlib, hmac, gzip, copy, itertools, math
+from urllib.parse import parse_qsl
+from functools import wraps
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+import calendar
+
+try:
+    import brotli  # Optional: sirf tab use hoga jab install ho
+except ImportError:
+    brotli = None
+
+try:
+    import ijson  # Optional: bade JSON uploads stream hote hain, warna json.loads fallback
+except ImportError:
+    ijson = None
 
 
 # ==========================================
@@ -26,47 +44,692 @@ CHANNEL_LINK1 = "https://t.me/+xHIueY41U3syODE1"
 
 MONGO_URI = os.getenv("MONGO_URI")
 
-bot = telebot.TeleBot(BOT_TOKEN)
+# Deploy modes: RUN_MODE=all (purana tareeka, ek process me web + polling),
+# web (gunicorn ke andar sirf Flask/SocketIO; bot updates WEBHOOK_URL se aate hain),
+# bot (sirf polling + background jobs, web alag process me).
+RUN_MODE = os.getenv("RUN_MODE", "all")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")  # e.g. https://your-app.onrender.com
+# Bot ka kaam (updates, broadcasts resume) isi process ka hai? web sirf tab jab webhook isi par aata ho
+BOT_DUTIES = RUN_MODE != "web" or bool(WEBHOOK_URL)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha1(f"wh:{BOT_TOKEN}".encode()).hexdigest()[:32]
+
+class LazyBot:
+    """Stands in for telebot.TeleBot: handler decorators are recorded at import, the real bot is built on first use."""
+
+    def __init__(self, factory):
+        self._factory, self._bot, self._handlers = factory, None, []
+        self._lock = threading.Lock()
+
+    def _register(kind):
+        def register(self, *args, **kwargs):
+            def decorator(fn):
+                with self._lock:
+                    self._handlers.append((kind, args, kwargs, fn))
+                    if self._bot is not None: getattr(self._bot, kind)(*args, **kwargs)(fn)
+                return fn
+            return decorator
+        return register
+
+    message_handler = _register("message_handler")
+    callback_query_handler = _register("callback_query_handler")
+
+    def get(self):
+        if self._bot is None:
+            with self._lock:
+                if self._bot is None:
+                    real = self._factory()
+                    for kind, args, kwargs, fn in self._handlers: getattr(real, kind)(*args, **kwargs)(fn)
+                    self._bot = real
+        return self._bot
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+# Webhook par updates humara UpdatePool chalata hai, telebot ka apna thread pool nahi.
+# TeleBot (aur threaded mode ke worker threads) pehli API call / update par hi bante hain.
+bot = LazyBot(lambda: telebot.TeleBot(BOT_TOKEN, threaded=not (WEBHOOK_URL and RUN_MODE != "bot")))
 app = Flask(__name__)
 CORS(app)
 app.config['SECRET_KEY'] = 'secret!'
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Battle rooms: ROOM_BACKEND=memory (ek worker) ya redis (kai workers/instances).
+# Redis par SocketIO emits bhi message queue se sab workers tak jaate hain.
+ROOM_BACKEND = os.getenv("ROOM_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE") or (
+    REDIS_URL if ROOM_BACKEND == "redis" and not REDIS_URL.startswith("fakeredis://") else None)
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE,
+                    async_mode=os.getenv("SOCKETIO_ASYNC_MODE") or None)  # None = auto (eventlet agar installed)
 
-# Live Match Memory (RAM)
-ROOMS = {} 
+# ==========================================
+# 📈 METRICS (Prometheus text format)
+# ==========================================
+# Chhota in-process registry: Flask routes, socket events, Mongo commands, Telegram API
+# calls aur PDF render ke histograms + live gauges. /metrics par Prometheus scrape kare
+# (METRICS_TOKEN set ho to Bearer token chahiye). Multi-worker par har worker alag scrape.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED") == "1"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Metric:
+    def __init__(self, name, help_text, kind, labels=()):
+        self.name, self.help, self.kind, self.labels = name, help_text, kind, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(l, "")) for l in self.labels)
+
+    def _fmt(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs: return ""
+        esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+class Counter(Metric):
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, "counter", labels)
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock: self._values[key] = self._values.get(key, 0) + value
+
+    def _samples(self):
+        with self._lock: return [f"{self.name}{self._fmt(k)} {v}" for k, v in self._values.items()]
+
+class Gauge(Metric):
+    """Value is pulled from `fn` at scrape time; fn returns a number or {label_value_tuple: number}."""
+
+    def __init__(self, name, help_text, fn, labels=()):
+        super().__init__(name, help_text, "gauge", labels)
+        self.fn = fn
+
+    def _samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [f"{self.name}{self._fmt(k if isinstance(k, tuple) else (k,))} {v}" for k, v in value.items()]
+        return [f"{self.name} {value}"]
+
+class PulledCounter(Gauge):
+    """Like Gauge (read from `fn` at scrape time), for monotonic counts kept by another object."""
+
+    def __init__(self, name, help_text, fn, labels=()):
+        super().__init__(name, help_text, fn, labels)
+        self.kind = "counter"
+
+class Histogram(Metric):
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, "histogram", labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None: counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def _samples(self):
+        out = []
+        with self._lock:
+            for key, counts in self._values.items():
+                running = 0
+                for le, n in zip(list(self.buckets) + ["+Inf"], counts[:-1]):
+                    running += n
+                    out.append(f"{self.name}_bucket{self._fmt(key, [('le', le)])} {running}")
+                out.append(f"{self.name}_count{self._fmt(key)} {running}")
+                out.append(f"{self.name}_sum{self._fmt(key)} {round(counts[-1], 6)}")
+        return out
+
+METRICS = []
+HTTP_SECONDS = Histogram("quiz_http_request_seconds", "Flask request latency", ("route", "method", "status"))
+SOCKET_SECONDS = Histogram("quiz_socket_event_seconds", "SocketIO event handler latency", ("event",))
+SOCKET_ERRORS = Counter("quiz_socket_event_errors_total", "SocketIO handlers that raised", ("event",))
+MONGO_SECONDS = Histogram("quiz_mongo_command_seconds", "MongoDB command latency", ("command", "collection", "ok"))
+MONGO_POOL_WAIT = Histogram("quiz_mongo_pool_wait_seconds", "Time waiting for a pooled Mongo connection",
+                            buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+TG_SECONDS = Histogram("quiz_telegram_api_seconds", "Telegram Bot API call latency", ("method", "status"))
+PDF_SECONDS = Histogram("quiz_pdf_render_seconds", "Mistakes PDF render time")
+
+IMPORT_SECS = FIRST_REQUEST_SECS = None
+
+@app.before_request
+def _start_timer():
+    global FIRST_REQUEST_SECS
+    g.t0 = time.perf_counter()
+    if FIRST_REQUEST_SECS is None:
+        FIRST_REQUEST_SECS = g.t0 - _IMPORT_T0
+        print(f"⏱️ First request {request.path} at {FIRST_REQUEST_SECS * 1000:.0f} ms after import start")
+
+@app.after_request
+def _observe_request(resp):
+    t0 = g.get("t0")
+    if t0 is not None:
+        # URL rule (template) label, raw path nahi - warna har uid alag series ban jaati
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_SECONDS.observe(time.perf_counter() - t0, route=route, method=request.method, status=resp.status_code)
+    return resp
+
+_socketio_on = socketio.on
+
+def timed_socket_on(message, namespace=None):
+    # socketio.on ki jagah: har event handler ka time + errors record hote hain
+    def decorator(handler):
+        @wraps(handler)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                SOCKET_ERRORS.inc(event=message)
+                raise
+            finally:
+                SOCKET_SECONDS.observe(time.perf_counter() - t0, event=message)
+        return _socketio_on(message, namespace)(timed)
+    return decorator
+
+socketio.on = timed_socket_on
+
+_tg_make_request = telebot.apihelper._make_request
+
+def timed_make_request(token, method_name, *args, **kwargs):
+    # Har bot.send_* / get_* yahin se guzarta hai
+    t0, status = time.perf_counter(), "ok"
+    try:
+        return _tg_make_request(token, method_name, *args, **kwargs)
+    except telebot.apihelper.ApiTelegramException as e:
+        status = str(e.error_code)
+        raise
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        TG_SECONDS.observe(time.perf_counter() - t0, method=method_name, status=status)
+
+telebot.apihelper._make_request = timed_make_request
+
+def render_metrics():
+    lines = []
+    for metric in METRICS: lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
 
 # ==========================================
 # 🗄️ DATABASE CONNECTION
 # ==========================================
-db_connected = False
-try:
-    if not MONGO_URI:
-        print("⚠️ WARNING: MONGO_URI not found!")
+# Client pehli query par banta hai (import/startup block nahi hota). Pool aur timeouts env
+# se tune hote hain taaki Atlas blip par request threads hamesha ke liye na latken.
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "neet_bot_db")
+MONGO_POOL_MAX = int(os.getenv("MONGO_POOL_MAX", 50))
+MONGO_POOL_MIN = int(os.getenv("MONGO_POOL_MIN", 0))
+MONGO_SELECT_TIMEOUT_MS = int(os.getenv("MONGO_SELECT_TIMEOUT_MS", 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 20000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000))
+MONGO_SLOW_MS = int(os.getenv("MONGO_SLOW_MS", 200))
+
+class MongoMetrics(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    """Slow-query log and pool checkout wait times, fed by pymongo's event listeners."""
+
+    def __init__(self, slow_ms):
+        self.slow_ms = slow_ms
+        self.commands = self.failures = self.slow = 0
+        self.pool_waits = deque(maxlen=500)
+        self.pool_timeouts = 0
+        self.recent_slow = deque(maxlen=20)
+        self._pending = {}
+        self._local = threading.local()
+
+    # --- commands ---
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        self._pending[event.request_id] = target if isinstance(target, str) else ""
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self.failures += 1
+        self._finish(event)
+
+    def _finish(self, event):
+        self.commands += 1
+        coll = self._pending.pop(event.request_id, "")
+        ms = event.duration_micros / 1000
+        MONGO_SECONDS.observe(ms / 1000, command=event.command_name, collection=coll,
+                              ok="0" if isinstance(event, monitoring.CommandFailedEvent) else "1")
+        if ms >= self.slow_ms:
+            self.slow += 1
+            self.recent_slow.append((event.command_name, coll, round(ms)))
+            print(f"🐢 Slow Mongo {event.command_name} {coll}: {ms:.0f} ms")
+
+    # --- pool (checkout started/finished ek hi thread par hota hai) ---
+    def connection_check_out_started(self, event):
+        self._local.t0 = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        t0 = getattr(self._local, "t0", None)
+        if t0 is not None:
+            self.pool_waits.append((time.perf_counter() - t0) * 1000)
+            MONGO_POOL_WAIT.observe(time.perf_counter() - t0)
+
+    def connection_check_out_failed(self, event):
+        if getattr(event, "reason", None) == "timeout": self.pool_timeouts += 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_checked_in(self, event): pass
+
+    def stats(self):
+        waits = sorted(self.pool_waits)
+        pct = lambda q: round(waits[min(len(waits) - 1, int(q * len(waits)))], 1) if waits else 0
+        return {"commands": self.commands, "failures": self.failures, "slow": self.slow,
+                "wait_p50": pct(0.5), "wait_p99": pct(0.99), "wait_timeouts": self.pool_timeouts,
+                "recent_slow": list(self.recent_slow)[-3:]}
+
+mongo_metrics = MongoMetrics(MONGO_SLOW_MS)
+_client, _client_lock = None, threading.Lock()
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import certifi  # Sirf pehle DB use par
+                _client = MongoClient(MONGO_URI, tlsCAFile=certifi.where(),
+                                      maxPoolSize=MONGO_POOL_MAX, minPoolSize=MONGO_POOL_MIN,
+                                      serverSelectionTimeoutMS=MONGO_SELECT_TIMEOUT_MS,
+                                      connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                                      socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                                      waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                                      retryWrites=True, event_listeners=[mongo_metrics])
+    return _client
+
+def get_db():
+    return get_client()[MONGO_DB_NAME]
+
+class LazyCollection:
+    """Stands in for a pymongo Collection until first use, then forwards everything to it."""
+
+    def __init__(self, name):
+        self._name, self._coll = name, None
+
+    def __getattr__(self, attr):
+        if self._coll is None: self._coll = get_db()[self._name]
+        return getattr(self._coll, attr)
+
+db_connected = bool(MONGO_URI)
+if not db_connected: print("⚠️ WARNING: MONGO_URI not found!")
+users_col = LazyCollection('users')
+questions_col = LazyCollection('questions')
+logs_col = LazyCollection('score_logs')
+mistakes_col = LazyCollection('mistakes')
+battles_col = LazyCollection('battles')
+broadcasts_col = LazyCollection('broadcasts')
+boards_col = LazyCollection('leaderboards')
+rollups_col = LazyCollection('score_rollups')
+bank_col = LazyCollection('question_bank')
+meta_col = LazyCollection('meta')
+
+# Har query ka index yahan hai (query -> index). create_index idempotent hai, har startup
+# par chalana safe hai; ek index fail ho (jaise purane duplicate) to baaki phir bhi bante hain.
+INDEXES = [
+    (mistakes_col, [("uid", 1), ("qh", 1)], {"unique": True}),   # sync upsert/delete
+    (mistakes_col, [("uid", 1), ("ts", -1)], {}),                 # /api/user/mistakes
+    (boards_col, [("board", 1), ("uid", 1)], {"unique": True}),  # leaderboard $inc, rank_of
+    (boards_col, [("board", 1), ("score", -1)], {}),             # load_top, rank count
+    (boards_col, [("expire_at", 1)], {"expireAfterSeconds": 0}), # Purane din/hafte apne aap hat jayenge
+    (users_col, [("xp", -1)], {}),                               # all-time top + rank
+    (questions_col, [("source", 1), ("type", 1), ("chapter", 1), ("part", 1)], {}),  # upload, chapter page, delete
+    (questions_col, [("qids", 1)], {}),                          # /dupes gc (bank record kahin use ho raha hai?)
+    (logs_col, [("ts", 1)], {}),                                 # rebuild_leaderboards
+    (logs_col, [("uid", 1), ("ts", -1)], {}),                    # per-user history
+    (rollups_col, [("day", 1), ("uid", 1)], {}),                 # rebuild_leaderboards (din/hafta)
+    (rollups_col, [("uid", 1), ("day", -1)], {}),                # per-user history
+    (broadcasts_col, [("status", 1)], {"unique": True, "name": "one_running_broadcast",  # resume_pending; saare
+                                       "partialFilterExpression": {"status": "running"}}),  # processes me ek hi chalu
+    (battles_col, [("ts", -1)], {}),
+]
+
+def ensure_indexes():
+    for coll, keys, opts in INDEXES:
+        try:
+            coll.create_index(keys, **opts)
+        except Exception as e:
+            print(f"Index Error ({coll.name} {keys}): {e}")
+
+def init_db():
+    # Startup ko Mongo ka wait nahi karna: indexes background me banenge
+    try: ensure_indexes()
+    except Exception as e: print(f"Index Error: {e}")
+    try: ensure_log_ttl()
+    except Exception as e: print(f"Log TTL Error: {e}")
+    rollup_job.start()
+    try:
+        if migrate_legacy_chapters(): bump_bank_version()
+        migrate_mistake_ids()
+    except Exception as e: print(f"Bank migration error: {e}")
+
+# ==========================================
+# 🧠 CONTENT CACHE (Versioned + ETag)
+# ==========================================
+# Question bank sirf upload/restore/delete par badalta hai, isliye har request par
+# Mongo se tree banana bekaar hai. Har write par BANK_VERSION badhta hai aur purana
+# cache apne aap bekaar ho jata hai. Version Mongo (meta.bank_version) me rehta hai taaki
+# bot process ka upload web process / doosre workers ka cache bhi BANK_VERSION_TTL me hata de.
+CONTENT_CACHE_MAX_BYTES = int(os.getenv("CONTENT_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+CONTENT_CACHE_MAX_ITEMS = int(os.getenv("CONTENT_CACHE_MAX_ITEMS", 512))
+BANK_VERSION_TTL = float(os.getenv("BANK_VERSION_TTL", 3))  # Itne second tak local version par bharosa
+
+class ContentCache:
+    """LRU cache of serialized JSON bodies, bounded by total bytes and entry count."""
+
+    def __init__(self, max_bytes, max_items):
+        self.max_bytes, self.max_items = max_bytes, max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        nbytes = entry_size(entry)
+        if nbytes > self.max_bytes: return  # Itna bada hai ki cache me rakhna hi nahi
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old: self.size -= entry_size(old)
+            self._items[key] = entry
+            self.size += nbytes
+            while self.size > self.max_bytes or len(self._items) > self.max_items:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= entry_size(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def stats(self):
+        return {"items": len(self._items), "bytes": self.size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+class TTLCache:
+    """Tiny thread-safe dict with per-entry expiry."""
+
+    def __init__(self, ttl, max_items=1024):
+        self.ttl, self.max_items = ttl, max_items
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is None or hit[1] < time.time(): return None
+            return hit[0]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            if len(self._items) >= self.max_items:
+                now = time.time()
+                self._items = {k: v for k, v in self._items.items() if v[1] >= now}
+                if len(self._items) >= self.max_items: self._items.clear()
+            self._items[key] = (value, time.time() + (self.ttl if ttl is None else ttl))
+
+content_cache = ContentCache(CONTENT_CACHE_MAX_BYTES, CONTENT_CACHE_MAX_ITEMS)
+BANK_VERSION = 0
+_bank_checked = 0
+_bank_lock = threading.Lock()
+
+def set_bank_version(version):
+    global BANK_VERSION, _bank_checked
+    with _bank_lock:
+        if version != BANK_VERSION:
+            BANK_VERSION = version
+            content_cache.clear()
+        _bank_checked = time.time()
+
+def bank_version():
+    # Shared version, har BANK_VERSION_TTL second me Mongo se dobara; Mongo down ho to local hi chalao
+    if db_connected and time.time() - _bank_checked > BANK_VERSION_TTL:
+        try: set_bank_version((meta_col.find_one({"_id": "bank_version"}) or {}).get("v", 0))
+        except Exception as e:
+            print(f"Bank version read error: {e}")
+            set_bank_version(BANK_VERSION)  # Agli koshish TTL ke baad, har request par nahi
+    return BANK_VERSION
+
+def bump_bank_version(chapters=()):
+    # Upload / Restore / Delete ke baad call karo; diye gaye chapters background me pre-encode honge
+    version = BANK_VERSION + 1
+    if db_connected:
+        try:
+            version = meta_col.find_one_and_update({"_id": "bank_version"}, {"$inc": {"v": 1}}, upsert=True,
+                                                   return_document=ReturnDocument.AFTER)["v"]
+        except Exception as e: print(f"Bank version bump error: {e}")
+    set_bank_version(version)
+    threading.Thread(target=warm_bank_cache, args=(list(chapters),), daemon=True).start()
+
+# --- PAYLOAD STORE (JSON ek baar encode, gzip/brotli variants ke sath) ---
+COMPRESS_MIN_BYTES = 512
+
+def entry_size(entry):
+    return sum(len(entry[k]) for k in ("body", "gzip", "br") if entry.get(k))
+
+def encode_payload(obj, version):
+    return encode_body(json.dumps(obj, separators=(',', ':'), default=str).encode('utf-8'), f"b{version}")
+
+def encode_body(body, tag):
+    entry = {"body": body, "etag": f"{tag}-{hashlib.sha1(body).hexdigest()[:16]}", "gzip": None, "br": None}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        entry["gzip"] = gzip.compress(body, compresslevel=6)
+        if brotli: entry["br"] = brotli.compress(body, quality=9)
+    return entry
+
+def get_payload(key, build):
+    full_key = (bank_version(),) + key
+    entry = content_cache.get(full_key)
+    if entry is None:
+        entry = encode_payload(build(), full_key[0])
+        content_cache.put(full_key, entry)
+    return entry
+
+def payload_response(entry, mimetype='application/json'):
+    # Client jo encoding maange (br > gzip > plain), wahi cached bytes seedha bhej do
+    offered = [enc for enc in ("br", "gzip") if entry.get(enc)]
+    encoding = request.accept_encodings.best_match(offered + ["identity"], default="identity") if offered else "identity"
+    body = entry["body"] if encoding == "identity" else entry[encoding]
+    etag = entry["etag"] if encoding == "identity" else f"{entry['etag']}-{encoding}"
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
     else:
-        client = MongoClient(MONGO_URI, tlsCAFile=certifi.where())
-        db = client['neet_bot_db']
-        users_col = db['users']
-        questions_col = db['questions']
-        logs_col = db['score_logs']
-        db_connected = True
-        print("✅ Connected to MongoDB Cloud Successfully!")
-except Exception as e:
-    print(f"❌ MongoDB Connection Failed: {e}")
+        resp = Response(body, mimetype=mimetype, direct_passthrough=True)
+        resp.content_length = len(body)
+        if encoding != "identity": resp.headers['Content-Encoding'] = encoding
+    resp.set_etag(etag)
+    resp.headers['Vary'] = 'Accept-Encoding'
+    resp.headers['Cache-Control'] = 'no-cache'  # Har baar revalidate, par 304 se sasta
+    return resp
+
+def cached_json(key, build):
+    """Serve `build()` as JSON from the payload cache, answering If-None-Match with 304."""
+    return payload_response(get_payload(key, build))
+
+def warm_bank_cache(chapters=()):
+    # Upload/Restore ke baad index aur naye chapters pehle se encode kar lo
+    version = BANK_VERSION
+    try:
+        get_payload(("index",), build_index)
+        for src, typ, chap in chapters:
+            page = 1
+            while True:
+                payload = build_chapter_page(src, typ, chap, page, CHAPTER_PAGE_SIZE)
+                if version != BANK_VERSION: return  # Beech me naya upload aa gaya
+                content_cache.put((version, "chapter", src, typ, chap, page, CHAPTER_PAGE_SIZE),
+                                  encode_payload(payload, version))
+                if not payload.get("has_more"): break
+                page += 1
+    except Exception as e:
+        print(f"Cache warm error: {e}")
+
+# ==========================================
+# 📝 SCORE LOG WRITER (Batched)
+# ==========================================
+# Har quiz finish par alag insert_one ki jagah logs yahan jama hote hain aur
+# chhote batches me insert_many se likhe jaate hain.
+LOG_FLUSH_SECS = float(os.getenv("LOG_FLUSH_SECS", 2))
+LOG_BATCH_MAX = 500
+
+class ScoreLogWriter:
+    def __init__(self, interval, batch_max):
+        self.interval, self.batch_max = interval, batch_max
+        self._buf = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, doc):
+        with self._lock:
+            self._buf.append(doc)
+            full = len(self._buf) >= self.batch_max
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        if full: self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            batch, self._buf = self._buf, []
+        if not batch: return
+        try:
+            logs_col.insert_many(batch, ordered=False)
+        except BulkWriteError:
+            pass  # Duplicate _id (same log dobara) - baaki insert ho chuke hain
+        except Exception as e:
+            print(f"Score log flush error: {e}")
+            return
+        try:
+            boards_col.bulk_write(leaderboard_ops(batch), ordered=False)
+        except Exception as e:
+            print(f"Leaderboard flush error: {e}")
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+score_log_writer = ScoreLogWriter(LOG_FLUSH_SECS, LOG_BATCH_MAX)
+atexit.register(score_log_writer.flush)
 
 # ==========================================
 # 🔐 SUBSCRIPTION CHECK (STRICT MODE)
 # ==========================================
-def check_membership(user_id):
+# get_chat_member har /start par call karna flood limit hit karta hai. Result cache hota
+# hai (member lamba, non-member chhota TTL), ek hi uid ki parallel requests ek API call
+# share karti hain, aur API error par haal hi me verified member ko lock out nahi karte.
+MEMBER_TTL = int(os.getenv("MEMBER_TTL", 600))
+NON_MEMBER_TTL = int(os.getenv("NON_MEMBER_TTL", 30))
+MEMBER_GRACE = 86400  # API down ho to itne purane "member" result par bharosa
+REQUIRE_MEMBERSHIP_API = os.getenv("REQUIRE_MEMBERSHIP_API", "0") == "1"
+INIT_DATA_MAX_AGE = int(os.getenv("INIT_DATA_MAX_AGE", 86400))  # Purana signed initData replay na ho
+
+class MembershipChecker:
+    def __init__(self):
+        self._cache = TTLCache(MEMBER_TTL, max_items=50000)
+        self._known = TTLCache(MEMBER_GRACE, max_items=50000)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "coalesced": 0, "api_calls": 0, "errors": 0}
+
+    def check(self, user_id, fresh=False):
+        uid = str(user_id)
+        cached = None if fresh else self._cache.get(uid)
+        if cached is not None:
+            self.counts["hits"] += 1
+            return cached
+        with self._lock:
+            waiter = self._inflight.get(uid)
+            if waiter is None: self._inflight[uid] = threading.Event()
+        if waiter is not None:
+            self.counts["coalesced"] += 1
+            waiter.wait(10)
+            cached = self._cache.get(uid)
+            return bool(cached)
+        self.counts["misses"] += 1
+        try:
+            result = self._fetch(uid)
+            self._cache.set(uid, result, MEMBER_TTL if result else NON_MEMBER_TTL)
+            if result: self._known.set(uid, True)
+            return result
+        finally:
+            with self._lock: self._inflight.pop(uid).set()
+
+    def _fetch(self, uid):
+        self.counts["api_calls"] += 1
+        try:
+            # Bot Channel me ADMIN hona chahiye tabhi ye kaam karega
+            member = bot.get_chat_member(CHANNEL_USERNAME, int(uid))
+            return member.status in ['creator', 'administrator', 'member']
+        except Exception as e:
+            # Agar error aaya (e.g., bot admin nahi hai), toh by default Allow mat karo,
+            # sirf haal hi me verified member ko chhodo
+            self.counts["errors"] += 1
+            print(f"Membership Check Error: {e}")
+            return bool(self._known.get(uid))
+
+membership = MembershipChecker()
+
+def check_membership(user_id, fresh=False):
+    return membership.check(user_id, fresh)
+
+def verify_init_data(init_data, max_age=INIT_DATA_MAX_AGE):
+    # Telegram WebApp initData: hash = HMAC(HMAC("WebAppData", bot_token), sorted "k=v" lines).
+    # Valid ho to signed user id (str), warna None
+    if not init_data: return None
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received = fields.pop('hash', '')
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    expected = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    if not received or not hmac.compare_digest(expected, received): return None
     try:
-        # Bot Channel me ADMIN hona chahiye tabhi ye kaam karega
-        member = bot.get_chat_member(CHANNEL_USERNAME, user_id)
-        if member.status in ['creator', 'administrator', 'member']:
-            return True
-        return False
-    except Exception as e:
-        # Agar error aaya (e.g., bot admin nahi hai), toh by default Allow mat karo
-        print(f"Membership Check Error: {e}")
-        return False
+        if max_age and time.time() - int(fields.get('auth_date', 0)) > max_age: return None
+        return str(json.loads(fields['user'])['id'])
+    except (KeyError, ValueError, TypeError):
+        return None
+
+def members_only(view):
+    # Web API routes ke liye optional check (REQUIRE_MEMBERSHIP_API=1 par). uid body/query se nahi,
+    # signed initData (X-Telegram-Init-Data header) se aata hai - warna koi bhi member ka id daal de
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if REQUIRE_MEMBERSHIP_API:
+            uid = verify_init_data(request.headers.get('X-Telegram-Init-Data'))
+            if not uid: return jsonify({"error": "Invalid Telegram session"}), 401
+            if not check_membership(uid): return jsonify({"error": "Join channel first"}), 403
+            g.uid = uid
+        return view(*args, **kwargs)
+    return wrapper
 
 def get_join_markup():
     markup = InlineKeyboardMarkup()
@@ -77,12 +740,66 @@ def get_join_markup():
 # ==========================================
 # 🧮 LOGIC
 # ==========================================
+# Level k+1 tak pahunchne ka total kharcha arithmetic series hai:
+# 100 + 120 + ... + (100 + 20(k-1)) = 10k² + 90k. Isliye loop ki jagah seedha k nikalte hain:
+# sabse bada k jiske liye 10k² + 90k <= xp.
+def levels_cleared(xp):
+    if xp < 100: return 0
+    n = int(xp)  # Series ka total integer hai, floor se answer nahi badalta
+    k = (math.isqrt(8100 + 40 * n) - 90) // 20
+    while 10 * k * k + 90 * k > n: k -= 1           # isqrt floor ki wajah se max ek step
+    while 10 * (k + 1) ** 2 + 90 * (k + 1) <= n: k += 1
+    return k
+
 def calculate_grade_stats(xp):
-    level = 1; cost = 100; temp_xp = xp
-    while temp_xp >= cost:
-        temp_xp -= cost; level += 1; cost += 20
+    k = levels_cleared(xp)
+    temp_xp, cost = xp - (10 * k * k + 90 * k), 100 + 20 * k
     percent = (temp_xp / cost) * 100
-    return {"grade": level, "current_xp": temp_xp, "req_xp": cost, "percent": min(percent, 100)}
+    return {"grade": k + 1, "current_xp": temp_xp, "req_xp": cost, "percent": min(percent, 100)}
+
+_numpy = False  # False = abhi import try nahi kiya (numpy import mehenga hai, cold start par nahi)
+
+def get_numpy():
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = None
+    return _numpy
+
+def grade_stats_batch(xps):
+    """calculate_grade_stats for a whole list at once (NumPy if installed); returns a list of dicts."""
+    np = get_numpy() if len(xps) >= 32 else None
+    if np is None: return [calculate_grade_stats(x) for x in xps]
+    xp = np.asarray(xps, dtype=np.float64)
+    n = np.floor(np.maximum(xp, 0))
+    k = np.floor((np.sqrt(8100 + 40 * n) - 90) / 20)
+    k -= (10 * k * k + 90 * k > n)                   # float sqrt ka rounding, dono taraf ek step
+    k += (10 * (k + 1) ** 2 + 90 * (k + 1) <= n)
+    k = np.where(xp < 100, 0, k)
+    cost = 100 + 20 * k
+    cur = xp - (10 * k * k + 90 * k)
+    percent = np.minimum(cur / cost * 100, 100)
+    ints = all(isinstance(x, int) for x in xps)     # JSON me wahi type jaaye jo scalar version deta
+    cur_out = cur.astype(np.int64).tolist() if ints else cur.tolist()
+    return [{"grade": int(g) + 1, "current_xp": c, "req_xp": int(r), "percent": float(p)}
+            for g, c, r, p in zip(k.tolist(), cur_out, cost.tolist(), percent.tolist())]
+
+def question_hash(text):
+    # Mistakes ko lambe HTML text ki jagah chhote stable hash se pehchante hain
+    norm = " ".join(str(text).split())
+    return hashlib.sha1(norm.encode('utf-8')).hexdigest()[:16]
+
+def question_id(q):
+    # Question bank ka stable ID: normalized text + options ka content hash (answer nahi,
+    # taaki galat answer wali copy bhi wahi record ho aur naya upload use sudhaar de)
+    parts = [q.get('q', '')] + [o for o in q.get('opts') or []]
+    return question_hash("\x1f".join(" ".join(str(p).split()) for p in parts))
+
+def is_qid(value):
+    return isinstance(value, str) and len(value) == 16 and all(c in "0123456789abcdef" for c in value)
 
 def parse_txt_file(content):
     lines = content.splitlines()
@@ -149,6 +866,9 @@ def send_welcome_menu(chat_id, first_name, user_id):
 @bot.message_handler(commands=['start'])
 def start(m):
     uid = m.from_user.id
+    if db_connected:
+        # /start kiya matlab ab bot block nahi hai, broadcast me dobara shamil
+        users_col.update_one({"_id": str(uid), "blocked": True}, {"$unset": {"blocked": ""}})
     
     if not check_membership(uid):
         markup = InlineKeyboardMarkup()
@@ -167,7 +887,7 @@ def start(m):
 @bot.callback_query_handler(func=lambda call: call.data == "check_sub")
 def callback_check(call):
     uid = call.from_user.id
-    if check_membership(uid):
+    if check_membership(uid, fresh=True):  # Abhi join kiya hoga, purana "No" cache ignore
         bot.answer_callback_query(call.id, "✅ Verified!")
         bot.delete_message(call.message.chat.id, call.message.message_id)
         send_welcome_menu(call.message.chat.id, call.from_user.first_name, uid)
@@ -177,6 +897,169 @@ def callback_check(call):
 # ==========================================
 # 📢 BROADCAST SYSTEM
 # ==========================================
+# Polling thread par nahi chalta: alag thread, sender pool, token bucket rate limit.
+# Progress Mongo me save hota hai taaki restart ke baad wahi se resume ho.
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))  # Telegram global limit ~30 msg/sec
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", 8))
+BROADCAST_CHUNK = 200
+BROADCAST_STATUS_SECS = 5  # Admin chat me bhi per-chat limit hai, status edit dheere
+BROADCAST_LEASE_SECS = int(os.getenv("BROADCAST_LEASE_SECS", 120))  # Heartbeat itna purana = sender mar gaya
+
+class TokenBucket:
+    """Blocking token bucket; `pause()` stalls everyone after a 429 retry_after."""
+
+    def __init__(self, rate, burst=None):
+        self.rate, self.burst = rate, burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                if wait <= 0: wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, secs):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + secs)
+
+class Broadcaster:
+    """Sends one broadcast job at a time; the job is leased (owner + heartbeat) so only one process sends it."""
+
+    def __init__(self, rate, workers):
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.owner = f"{os.getpid()}-{os.urandom(4).hex()}"
+        self._active = None
+
+    def busy(self):
+        # Doosre process (bot/web/worker) ka chalu job bhi gina jaata hai; heartbeat expire ho chuka
+        # job "busy" nahi, resume_pending use utha lega
+        if self._active is not None: return True
+        live = {"status": "running", "heartbeat": {"$gte": time.time() - BROADCAST_LEASE_SECS}}
+        return db_connected and broadcasts_col.count_documents(live, limit=1) > 0
+
+    def audience(self):
+        return users_col.count_documents({"blocked": {"$ne": True}})
+
+    def start(self, text, chat_id, status_msg_id, total=None):
+        job = {"text": text, "status": "running", "last_uid": None, "sent": 0, "failed": 0, "blocked": 0,
+               "total": self.audience() if total is None else total,
+               "chat_id": chat_id, "status_msg_id": status_msg_id, "started": time.time(),
+               "owner": self.owner, "heartbeat": time.time()}
+        try:
+            job["_id"] = broadcasts_col.insert_one(job).inserted_id
+        except DuplicateKeyError:
+            return None  # Kisi aur process ne abhi abhi broadcast shuru kiya (unique index)
+        self._spawn(job)
+        return job
+
+    def resume_pending(self):
+        # Restart ke baad adhoora broadcast wahin se aage - sirf jiski lease expire ho chuki ho,
+        # aur atomic claim taaki do processes ek hi job dobara na bhejein
+        if not db_connected or self._active is not None: return None
+        now = time.time()
+        job = broadcasts_col.find_one_and_update(
+            {"status": "running", "$or": [{"heartbeat": {"$lt": now - BROADCAST_LEASE_SECS}}, {"heartbeat": {"$exists": False}}]},
+            {"$set": {"owner": self.owner, "heartbeat": now}}, return_document=ReturnDocument.AFTER)
+        if job: self._spawn(job)
+        return job
+
+    def _spawn(self, job):
+        self._active = job
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _send_one(self, uid, text):
+        for _ in range(5):
+            self.bucket.take()
+            try:
+                bot.send_message(uid, f"📢 **ANNOUNCEMENT**\n\n{text}", parse_mode="Markdown")
+                return "sent"
+            except telebot.apihelper.ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                    self.bucket.pause(retry)
+                    continue
+                if e.error_code == 403 or 'chat not found' in str(e.description).lower():
+                    return "blocked"  # Blocked / deleted account / chat not found
+                return "failed"
+            except Exception:
+                return "failed"
+        return "failed"
+
+    def _run(self, job):
+        session_start, session_sent, last_edit = time.time(), 0, 0
+        query = {"blocked": {"$ne": True}}
+        if job.get("last_uid") is not None: query["_id"] = {"$gt": job["last_uid"]}
+        cursor = users_col.find(query, {"_id": 1}).sort("_id", 1).batch_size(BROADCAST_CHUNK)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                chunk = []
+                for user in cursor:
+                    chunk.append(user['_id'])
+                    if len(chunk) < BROADCAST_CHUNK: continue
+                    session_sent += self._process(job, chunk, pool)
+                    chunk = []
+                    if job.get("lost"):
+                        print("Broadcast lease lost, stopping sender")
+                        return
+                    if time.time() - last_edit >= BROADCAST_STATUS_SECS:
+                        self._edit_status(job, session_sent / max(time.time() - session_start, 0.001))
+                        last_edit = time.time()
+                if chunk: session_sent += self._process(job, chunk, pool)
+            if job.get("lost"): return
+            broadcasts_col.update_one({"_id": job["_id"], "owner": self.owner},
+                                      {"$set": {"status": "done", "finished": time.time()}})
+            job["status"] = "done"
+            self._edit_status(job, session_sent / max(time.time() - session_start, 0.001))
+        except Exception as e:
+            print(f"Broadcast Error: {e}")
+            # Lease chhod do: job "running" hi rehta hai par turant resumable (agla /broadcast ya restart)
+            try:
+                broadcasts_col.update_one({"_id": job["_id"], "owner": self.owner},
+                                          {"$set": {"heartbeat": 0, "error": str(e)[:200]}, "$unset": {"owner": ""}})
+                job["status"] = "paused"
+                self._edit_status(job, session_sent / max(time.time() - session_start, 0.001))
+            except Exception as e2:
+                print(f"Broadcast lease release error: {e2}")  # Lease BROADCAST_LEASE_SECS me khud expire hogi
+        finally:
+            self._active = None
+
+    def _process(self, job, uids, pool):
+        results = list(pool.map(lambda uid: self._send_one(uid, job["text"]), uids))
+        blocked_ids = [uid for uid, r in zip(uids, results) if r == "blocked"]
+        if blocked_ids: users_col.update_many({"_id": {"$in": blocked_ids}}, {"$set": {"blocked": True}})
+        delta = {k: results.count(k) for k in ("sent", "failed", "blocked")}
+        for k, v in delta.items(): job[k] += v
+        job["last_uid"] = uids[-1]
+        # Progress ke sath heartbeat; owner badal gaya (lease chhin gayi) to ye sender ruk jaata hai
+        res = broadcasts_col.update_one({"_id": job["_id"], "owner": self.owner},
+                                        {"$set": {"last_uid": uids[-1], "heartbeat": time.time()}, "$inc": delta})
+        if not res.matched_count: job["lost"] = True
+        return delta["sent"]
+
+    def _edit_status(self, job, rate):
+        done = job["sent"] + job["failed"] + job["blocked"]
+        head = ("✅ Broadcast Complete!" if job["status"] == "done" else
+                f"⚠️ Broadcast paused at {done}/{job['total']} (error) - /broadcast se resume" if job["status"] == "paused" else
+                f"🚀 Broadcasting... {done}/{job['total']}")
+        try:
+            bot.edit_message_text(f"{head}\n\nSent: {job['sent']}\nFailed: {job['failed']}\nBlocked: {job['blocked']}\n"
+                                  f"Speed: {rate:.1f} msg/s", job["chat_id"], job["status_msg_id"])
+        except Exception as e:
+            print(f"Broadcast status edit error: {e}")
+
+broadcaster = Broadcaster(BROADCAST_RATE, BROADCAST_WORKERS)
+
 @bot.message_handler(commands=['broadcast'])
 def broadcast_message(message):
     uid = str(message.from_user.id)
@@ -187,31 +1070,116 @@ def broadcast_message(message):
     if len(msg_text) < 2:
         bot.reply_to(message, "⚠️ Usage: `/broadcast Your Message Here`")
         return
+    if not db_connected:
+        bot.reply_to(message, "❌ Database Connected nahi hai!")
+        return
+    if broadcaster.busy():
+        bot.reply_to(message, "⏳ Ek broadcast pehle se chal raha hai.")
+        return
+    resumed = broadcaster.resume_pending()  # Ruka hua (error / dead sender) job pehle poora karo
+    if resumed:
+        bot.reply_to(message, f"♻️ Pichla adhoora broadcast resume kiya ({resumed['sent']}/{resumed['total']} ho chuke). "
+                              "Naya message uske baad bhejein.")
+        return
     
-    text_to_send = msg_text[1]
-    
-    # Database se users nikalo
-    users = users_col.find({}, {"_id": 1})
-    total = users_col.count_documents({})
-    success = 0
-    blocked = 0
-    
-    status_msg = bot.reply_to(message, f"🚀 Broadcast started to {total} users...")
-    
-    for user in users:
-        try:
-            bot.send_message(user['_id'], f"📢 **ANNOUNCEMENT**\n\n{text_to_send}", parse_mode="Markdown")
-            success += 1
-            time.sleep(0.1) # Flood limit se bachne ke liye
-        except Exception:
-            blocked += 1
-            
-    bot.edit_message_text(f"✅ **Broadcast Complete!**\n\nSent: {success}\nFailed/Blocked: {blocked}", message.chat.id, status_msg.message_id)
+    status_msg = bot.reply_to(message, "🚀 Broadcast starting...")
+    # "started" edit thread se pehle, warna chhoti audience par ye "Complete" summary ko overwrite kar deta
+    total = broadcaster.audience()
+    bot.edit_message_text(f"🚀 Broadcast started to {total} users...", message.chat.id, status_msg.message_id)
+    if not broadcaster.start(msg_text[1], message.chat.id, status_msg.message_id, total):
+        bot.edit_message_text("⏳ Ek broadcast pehle se chal raha hai.", message.chat.id, status_msg.message_id)
     
 
 # ==========================================
 # 💾 BACKUP SYSTEM
 # ==========================================
+# Har collection cursor se batch me padhi jaati hai aur gzip NDJSON me likhi jaati hai
+# (ek line = {"c": collection, "d": document}), isliye memory flat rehti hai. File
+# BACKUP_PART_BYTES se badi ho to agle part me chali jaati hai, taaki har part
+# /restore ke liye bot dobara download kar sake.
+BACKUP_BATCH = 1000
+BACKUP_PART_BYTES = int(os.getenv("BACKUP_PART_BYTES", 19 * 1024 * 1024))  # Bot 20 MB se badi file download nahi kar sakta
+
+def backup_sources():
+    # (naam, collection, query, projection) - ID hata diya taaki restore me issue na aaye
+    if BACKUP_RAW_LOGS:
+        logs_query = {}
+    else:
+        # Rollup watermark ke baad wale scores abhi rollups me nahi hain; us din ki shuruaat se raw
+        # logs bhi jaate hain, taaki restore ke baad rollup wo poora din sahi dobara bana sake
+        mark = meta_col.find_one({"_id": "rollup"}) or {}
+        logs_query = {"ts": {"$gte": day_start_ts(mark.get("upto", 0))}}
+    return [
+        ("users", users_col, {}, {"_id": 1, "name": 1, "xp": 1, "mistakes": 1, "mistake_count": 1, "blocked": 1}),
+        ("mistakes", mistakes_col, {}, {"_id": 0}),
+        ("bank", bank_col, {}, None),
+        ("questions", questions_col, {}, {"_id": 0}),
+        ("rollups", rollups_col, {}, None),  # Raw logs TTL se expire hote hain, daily rollups kaafi hain
+        ("logs", logs_col, logs_query, {"_id": 0, "at": 0}),
+    ]
+
+class BackupWriter:
+    """Writes NDJSON lines into gzip parts, handing each finished part to `on_part`."""
+
+    def __init__(self, stamp, on_part):
+        self.stamp, self.on_part = stamp, on_part
+        self.part = 0
+        self.bytes_total = 0
+        self._raw = self._gz = None
+
+    def _open(self):
+        self.part += 1
+        self._path = os.path.join(tempfile.gettempdir(), f"NeetBot_Backup_{self.stamp}.part{self.part}.ndjson.gz")
+        self._raw = open(self._path, "wb")
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+        self._write_lines([{"c": "_meta", "d": {"timestamp": self.stamp, "part": self.part, "format": 2}}])
+
+    def _write_lines(self, rows):
+        self._gz.write("".join(json.dumps(r, default=str, separators=(',', ':')) + "\n" for r in rows).encode("utf-8"))
+
+    def write(self, coll, docs):
+        if self._gz is None: self._open()
+        self._write_lines({"c": coll, "d": d} for d in docs)
+        self._gz.flush()  # Compressor ka buffer nikalo taaki file size sahi dikhe
+        if self._raw.tell() >= BACKUP_PART_BYTES: self.close()
+
+    def close(self):
+        if self._gz is None: return
+        self._gz.close(); self._raw.close()
+        self._gz = self._raw = None
+        self.bytes_total += os.path.getsize(self._path)
+        try:
+            self.on_part(self._path, self.part)
+        finally:
+            os.remove(self._path)  # Local file delete karo (cleanup)
+
+def run_backup(chat_id):
+    started, counts = time.time(), {}
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    def send_part(path, part):
+        with open(path, "rb") as f:
+            bot.send_document(chat_id, f, caption=f"✅ **Database Backup** (Part {part})\n\nIs file ko sambhal kar rakhein. Restore karne ke liye har part ko bhejkar caption me `/restore` likhein.")
+
+    writer = BackupWriter(stamp, send_part)
+    try:
+        score_log_writer.flush()  # Is process ke buffer wale scores bhi
+        for name, col, query, projection in backup_sources():
+            counts[name], batch = 0, []
+            for doc in col.find(query, projection).batch_size(BACKUP_BATCH):
+                batch.append(doc)
+                if len(batch) >= BACKUP_BATCH:
+                    writer.write(name, batch); counts[name] += len(batch); batch = []
+            if batch: writer.write(name, batch); counts[name] += len(batch)
+        writer.close()
+        secs = max(time.time() - started, 0.001)
+        total = sum(counts.values())
+        bot.send_message(chat_id, "📦 Backup Report\n\n" + "\n".join(f"{k}: {v}" for k, v in counts.items()) +
+                         f"\n\nParts: {writer.part} | Size: {writer.bytes_total / 1048576:.1f} MB"
+                         f"\nTime: {secs:.1f}s | Speed: {total / secs:.0f} docs/s")
+    except Exception as e:
+        bot.send_message(chat_id, f"❌ Backup Failed: {str(e)}")
+
 @bot.message_handler(commands=['backup'])
 def export_backup(message):
     uid = str(message.from_user.id)
@@ -222,34 +1190,400 @@ def export_backup(message):
         return
 
     bot.send_message(message.chat.id, "⏳ Creating Backup... Please wait.")
+    # Polling thread ko block mat karo
+    threading.Thread(target=run_backup, args=(message.chat.id,), daemon=True).start()
+
+
+# ==========================================
+# 📊 STATS (Admin)
+# ==========================================
+@bot.message_handler(commands=['stats'])
+def admin_stats(message):
+    if str(message.from_user.id) != str(ADMIN_ID): return
+    c, r, m, g = content_cache.stats(), report_queue.stats(), membership.counts, room_mgr.gauges()
+    mm, dbm, ru = matchmaker.gauges(), mongo_metrics.stats(), rollup_job.stats()
+    bot.reply_to(message, f"📊 Server Stats\n\n"
+                          f"🧠 Content Cache (v{BANK_VERSION})\n"
+                          f"Items: {c['items']} | Size: {c['bytes'] // 1024} KB\n"
+                          f"Hits: {c['hits']} | Misses: {c['misses']} | Evicted: {c['evictions']}\n"
+                          f"Brotli: {'ON' if brotli else 'OFF'}\n\n"
+                          f"📄 PDF Reports\n"
+                          f"Queue: {r['depth']} | Sent: {r['sent']} | Failed: {r['failed']}\n"
+                          f"Dropped: {r['dropped']} | Deduped: {r['deduped']} | Retries: {r['retries']}\n"
+                          f"Avg Render: {r['render_ms']} ms | Avg Upload: {r['upload_ms']} ms\n\n"
+                          f"🔐 Membership Cache\n"
+                          f"Hits: {m['hits']} | Misses: {m['misses']} | Coalesced: {m['coalesced']}\n"
+                          f"API Calls: {m['api_calls']} | Errors: {m['errors']}\n\n"
+                          f"⚔️ Battle Rooms\n"
+                          f"Backend: {g['backend']} | Live: {g['rooms']} {g['states']} | Sockets: {g['sids']}\n"
+                          f"Questions Held: {g['question_bytes'] // 1024} KB\n"
+                          f"Created: {g['created']} | Reaped: {g['reaped']}\n\n"
+                          f"🎲 Matchmaking\n"
+                          f"Waiting: {mm['waiting']} in {mm['pools']} pools | Oldest: {mm['oldest_wait']}s\n"
+                          f"Matched: {mm['matched']} | Timeouts: {mm['timeouts']} | Cancelled: {mm['cancelled']}\n"
+                          f"Wait: {mm['wait_hist']}\n\n"
+                          f"🗄️ MongoDB (pool {MONGO_POOL_MAX})\n"
+                          f"Commands: {dbm['commands']} | Failed: {dbm['failures']} | Slow (>{MONGO_SLOW_MS}ms): {dbm['slow']}\n"
+                          f"Pool Wait p50/p99: {dbm['wait_p50']}/{dbm['wait_p99']} ms | Timeouts: {dbm['wait_timeouts']}\n"
+                          f"Recent Slow: {dbm['recent_slow']}\n\n"
+                          f"🗃️ Log Retention ({LOG_RETENTION_DAYS}d raw)\n"
+                          f"Rollup Runs: {ru['runs']} | Errors: {ru['errors']} | Last: {ru['last_ms']} ms\n"
+                          f"Watermark Lag: {ru['lag']}s | Backfilled: {ru['backfilled']}")
+
+
+# ==========================================
+# 📥 QUESTION BANK INGEST (Streaming + Chunked)
+# ==========================================
+# Alian JSON ko poora tree banaye bina padhte hain: ijson events se nodes ek explicit
+# stack par bante hain aur jaise hi question node poora hota hai, yield karke parent se
+# hata diya jaata hai. Recursion nahi, isliye deep exports par bhi limit hit nahi hota.
+# Questions ek shared `question_bank` me content hash (question_id) se rehte hain; chapter
+# sirf `qids` list rakhta hai, jo bade chapter me kai `part` documents me bant jaati hai.
+CHAPTER_PART_QIDS = int(os.getenv("CHAPTER_PART_QIDS", 50000))  # ~1.3 MB per part doc
+BANK_WRITE_BATCH = 1000
+CHAPTER_ITEMS = {"$ifNull": ["$qids", {"$ifNull": ["$data", []]}]}  # Naya (qids) ya purana (data)
+
+def clean_html(text):
+    if not text: return ""
+    text = str(text)
+    if text.startswith('"') and text.endswith('"'):
+        try: text = json.loads(text)
+        except: text = text[1:-1]
+    text = text.replace('\\/', '/').replace('\\"', '"')
+    text = text.replace('\\n', '<br>').replace('\\t', '&nbsp;&nbsp;&nbsp;')
+    return text.strip()
+
+def question_node(node, in_content):
+    # (question, parent) agar node question hai; `content` ke andar wala parent sambhalega
+    if 'content' in node and isinstance(node['content'], dict) and 'qns_content' in node['content']:
+        return node['content'], node   # Scenario 1: Result JSON
+    if 'qns_content' in node and 'options' in node and not in_content:
+        return node, node              # Scenario 2: Question JSON
+    return None
+
+def walk_alian(data):
+    # Fallback (ijson nahi): pehle se parsed tree ka iterative, order-preserving walk
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            hit = question_node(node, False)
+            if hit: yield hit; continue
+            stack.extend(reversed(list(node.values())))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+
+def stream_alian(raw):
+    """Yield (question, parent) pairs from raw JSON bytes without materializing the whole document."""
+    stack = []  # [container, pending_key]
+    for _, event, value in ijson.parse(io.BytesIO(raw), use_float=True):
+        if event in ('start_map', 'start_array'):
+            stack.append([{} if event == 'start_map' else [], None])
+            continue
+        if event == 'map_key':
+            stack[-1][1] = value
+            continue
+        if event in ('end_map', 'end_array'):
+            node = stack.pop()[0]
+            if event == 'end_map':
+                in_content = bool(stack) and isinstance(stack[-1][0], dict) and stack[-1][1] == 'content'
+                hit = question_node(node, in_content)
+                if hit:
+                    yield hit
+                    continue  # Parent me attach nahi, memory free
+        else:
+            node = value
+        if not stack: return
+        parent, key = stack[-1]
+        if isinstance(parent, dict): parent[key] = node
+        else: parent.append(node)
+
+def alian_question(q_node, parent_node):
+    """Normalize one Alian node into {q, opts, ans, diff}; returns (id, question) or (None, reason)."""
+    q_id = parent_node.get('id') or parent_node.get('unique_identifier') or q_node.get('id')
+    diff = parent_node.get('difficulty') or q_node.get('difficulty', 'EASY')
+    cleaned_q = clean_html((q_node.get('qns_content') or {}).get('text', ''))
+    if not cleaned_q: return None, "empty"
+    opts = [clean_html(opt.get('text', '')) for opt in q_node.get('options', []) if isinstance(opt, dict)]
+    # 2 ya usse zyada options wale sab save karo (True/False ko bhi include karega)
+    if len(opts) < 2: return None, "options"
+    ans_index = 0
+    ans_str = q_node.get('answer') or parent_node.get('answer', '[]')
+    if ans_str and str(ans_str).strip() not in ['[]', '""', 'null', 'None']:
+        try:
+            ans_list = json.loads(str(ans_str))
+            if len(ans_list) > 0: ans_index = int(ans_list[0])
+        except: pass
+    return q_id or cleaned_q, {"q": cleaned_q, "opts": opts[:4], "ans": ans_index, "diff": diff}
+
+def chapter_key(source, typ, chapter, part):
+    # Purane docs me `part` field nahi hai, unhe part 0 maano
+    key = {"source": source, "type": typ, "chapter": chapter}
+    key["part"] = {"$in": [0, None]} if part == 0 else part
+    return key
+
+def save_chapter(source, typ, chapter, mode, questions):
+    """Upsert questions into the shared bank and store the chapter as `qids` parts; returns an ingest report."""
+    report = {"parts": 0, "saved": 0, "duplicates": 0, "in_bank": 0}
+    qids, seen, batch = [], set(), []
+
+    def write_bank():
+        if not batch: return
+        res = bank_col.bulk_write([UpdateOne({"_id": qid}, {"$set": {k: v for k, v in q.items() if k not in ("id", "_id")},
+                                                            "$setOnInsert": {"ts": time.time()}}, upsert=True)
+                                   for qid, q in batch], ordered=False)
+        report["in_bank"] += len(batch) - res.upserted_count  # Pehle se kisi chapter me tha
+        batch.clear()
+
+    def write_part():
+        write_bank()  # Chapter kabhi aise ID ko point na kare jo bank me nahi
+        questions_col.update_one(chapter_key(source, typ, chapter, report["parts"]),
+                                 {"$set": {"source": source, "type": typ, "chapter": chapter, "part": report["parts"],
+                                           "mode": mode, "qids": qids}, "$unset": {"data": ""}}, upsert=True)
+        report["parts"] += 1
+
+    for q in questions:
+        qid = question_id(q)
+        if qid in seen:
+            report["duplicates"] += 1; continue
+        seen.add(qid); report["saved"] += 1
+        batch.append((qid, q)); qids.append(qid)
+        if len(batch) >= BANK_WRITE_BATCH: write_bank()
+        if len(qids) >= CHAPTER_PART_QIDS:
+            write_part(); qids = []
+    if qids or report["parts"] == 0: write_part()
+    # Pichli upload zyada lambi thi to uske bache parts hatao
+    questions_col.delete_many({"source": source, "type": typ, "chapter": chapter, "part": {"$gte": report["parts"]}})
+    return report
+
+def resolve_questions(items):
+    """Turn chapter items (bank IDs or legacy embedded dicts) into question dicts carrying `id`, order kept."""
+    ids = [x for x in items if isinstance(x, str)]
+    found = {}
+    for i in range(0, len(ids), 5000):
+        for d in bank_col.find({"_id": {"$in": ids[i:i + 5000]}}, {"ts": 0}):
+            found[d.pop('_id')] = d
+    out = []
+    for x in items:
+        if isinstance(x, str):
+            if x in found: out.append(dict(found[x], id=x))
+        elif isinstance(x, dict):
+            out.append(dict(x, id=question_id(x)))
+    return out
+
+def migrate_legacy_chapters():
+    # Embedded `data` wale purane chapters ko bank + qids me badlo (ek baar, startup par)
+    legacy = questions_col.aggregate([{"$match": {"data": {"$exists": True}}},
+                                      {"$group": {"_id": {"source": "$source", "type": "$type", "chapter": "$chapter"},
+                                                  "mode": {"$first": "$mode"}}}])
+    moved = 0
+    for row in legacy:
+        src, typ, chap = row['_id']['source'], row['_id']['type'], row['_id']['chapter']
+
+        def items():
+            for doc in questions_col.find({"source": src, "type": typ, "chapter": chap}).sort("part", 1):
+                yield from resolve_questions(doc.get('qids') or doc.get('data') or [])
+
+        save_chapter(src, typ, chap, row.get('mode') or 'normal', items())
+        moved += 1
+    return moved
+
+def migrate_mistake_ids(batch=1000):
+    # Purane mistakes ka qh sirf text ka hash tha; ab question_id (text + options)
+    moved = 0
+    while True:
+        docs = list(mistakes_col.find({"qv": {"$ne": 2}}, {"q": 1, "opts": 1}).limit(batch))
+        if not docs: return moved
+        try:
+            mistakes_col.bulk_write([UpdateOne({"_id": d['_id']}, {"$set": {"qh": question_id(d), "qv": 2}})
+                                     for d in docs], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            # Same question ki do purani copies ek hi naye ID par aa gayi: doosri hata do
+            dup = [docs[err['index']]['_id'] for err in errors if err.get('code') == 11000]
+            if dup: mistakes_col.delete_many({"_id": {"$in": dup}})
+            if len(dup) < len(errors): raise
+        moved += len(docs)
+
+def run_alian_ingest(raw, source, typ, chapter, chat_id, reply_to):
+    started = time.perf_counter()
+    report = {"nodes": 0, "duplicates": 0, "empty": 0, "options": 0, "errors": 0}
+    seen_ids = set()  # Asli Unique ID store karne ke liye
+
+    def accepted():
+        nodes = stream_alian(raw) if ijson else walk_alian(json.loads(raw.decode('utf-8')))
+        for q_node, parent in nodes:
+            report["nodes"] += 1
+            try:
+                q_id, q = alian_question(q_node, parent)
+            except Exception as e:
+                report["errors"] += 1
+                print(f"Extraction error: {e}")
+                continue
+            if q_id is None:
+                report[q] += 1; continue
+            if q_id in seen_ids:
+                report["duplicates"] += 1; continue
+            seen_ids.add(q_id)
+            yield q
+
+    try:
+        # Toota JSON beech me fail ho to chapter aadha na likha jaye: pehle sirf tokenize karke validate
+        if ijson:
+            for _ in ijson.basic_parse(io.BytesIO(raw)): pass
+        # Pehla valid question milne tak kuch na likho, warna invalid file purana chapter mita degi
+        it = accepted()
+        first = next(it, None)
+        if first is None:
+            bot.send_message(chat_id, "❌ Invalid JSON! Koi valid questions nahi mile.", reply_to_message_id=reply_to)
+            return
+        saved = save_chapter(source, typ, chapter, "alian", itertools.chain([first], it))
+        bump_bank_version([(source, typ, chapter)])
+        dropped = report["empty"] + report["options"] + report["errors"]
+        bot.send_message(chat_id, f"👽 **ALIAN 2.0 Uploaded Successfully!**\n\n📁 Path: {source} -> {typ} -> {chapter}\n"
+                                  f"✅ Total Questions Saved: {saved['saved']} ({saved['parts']} part)\n"
+                                  f"🔁 Duplicates: {report['duplicates'] + saved['duplicates']} | "
+                                  f"📚 Already in bank: {saved['in_bank']} | 🗑️ Dropped: {dropped} "
+                                  f"(empty {report['empty']}, <2 opts {report['options']}, errors {report['errors']})\n"
+                                  f"⏱️ Parse + Save: {time.perf_counter() - started:.2f}s "
+                                  f"({'stream' if ijson else 'json'}, {len(raw) // 1024} KB)",
+                         reply_to_message_id=reply_to)
+    except Exception as e:
+        bot.send_message(chat_id, f"❌ Error: {e}", reply_to_message_id=reply_to)
 
+@bot.message_handler(commands=['dupes'])
+def dupes_command(message):
+    # /dupes -> kaun se chapters questions share karte hain; /dupes gc -> kisi chapter me na bache bank records hatao
+    if str(message.from_user.id) != str(ADMIN_ID): return
+    gc = 'gc' in message.text.split()[1:]
+    status = bot.reply_to(message, "🔍 Scanning question bank...")
+    threading.Thread(target=run_dupes_report, args=(message.chat.id, status.message_id, gc), daemon=True).start()
+
+def run_dupes_report(chat_id, status_msg_id, gc=False):
     try:
-        # 1. Saara Data Fetch karo
-        users = list(users_col.find({}, {"_id": 1, "name": 1, "xp": 1, "mistakes": 1}))
-        questions = list(questions_col.find({}, {"_id": 0})) # ID hata diya taaki restore me issue na aaye
-        logs = list(logs_col.find({}, {"_id": 0}))
-
-        backup_data = {
-            "timestamp": str(datetime.now()),
-            "users": users,
-            "questions": questions,
-            "logs": logs
-        }
-
-        # 2. JSON File banao
-        file_name = f"NeetBot_Backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        with open(file_name, "w", encoding="utf-8") as f:
-            json.dump(backup_data, f, indent=4, default=str)
-
-        # 3. File bhejo
-        with open(file_name, "rb") as f:
-            bot.send_document(message.chat.id, f, caption="✅ **Full Database Backup**\n\nIs file ko sambhal kar rakhein. Restore karne ke liye is file ko bhejkar caption me `/restore` likhein.")
-
-        # 4. Local file delete karo (cleanup)
-        os.remove(file_name)
+        where = {"$concat": ["$source", " › ", "$type", " › ", "$chapter"]}
+        per_q = [{"$match": {"qids": {"$exists": True}}},
+                 {"$project": {"qids": 1, "where": where}}, {"$unwind": "$qids"},
+                 {"$group": {"_id": "$qids", "where": {"$addToSet": "$where"}, "refs": {"$sum": 1}}}]
+        facets = {
+            "totals": [{"$group": {"_id": None, "unique": {"$sum": 1}, "refs": {"$sum": "$refs"},
+                                   "shared": {"$sum": {"$cond": [{"$gt": [{"$size": "$where"}, 1]}, 1, 0]}}}}],
+            "top": [{"$match": {"where.1": {"$exists": True}}},
+                    {"$group": {"_id": "$where", "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1}}, {"$limit": 10}]}
+        res = next(questions_col.aggregate(per_q + [{"$facet": facets}], allowDiskUse=True))
+        totals = (res["totals"] or [{"unique": 0, "refs": 0, "shared": 0}])[0]
+        lines = [f"{r['count']} × " + " ⇄ ".join(sorted(r['_id'])[:3]) for r in res["top"]]
+        bank_total = bank_col.estimated_document_count()
+        orphans = bank_col.aggregate([
+            {"$lookup": {"from": questions_col.name, "localField": "_id", "foreignField": "qids",
+                         "pipeline": [{"$project": {"_id": 1}}, {"$limit": 1}], "as": "used"}},
+            {"$match": {"used": []}}, {"$project": {"_id": 1}}])
+        orphan_ids = [d['_id'] for d in orphans]
+        if gc and orphan_ids:
+            for i in range(0, len(orphan_ids), 5000): bank_col.delete_many({"_id": {"$in": orphan_ids[i:i + 5000]}})
+        bot.edit_message_text(f"🧬 Question Bank\n\nRecords: {bank_total} | Chapter refs: {totals['refs']}\n"
+                              f"Shared across chapters: {totals['shared']} "
+                              f"(saved {totals['refs'] - totals['unique']} copies)\n"
+                              f"Orphans: {len(orphan_ids)}{' (deleted)' if gc and orphan_ids else ''}\n\n"
+                              f"Top overlaps:\n" + ("\n".join(lines) or "None"), chat_id, status_msg_id)
+    except Exception as e:
+        bot.edit_message_text(f"❌ Dupes scan failed: {e}", chat_id, status_msg_id)
 
+# ==========================================
+# ♻️ RESTORE PIPELINE
+# ==========================================
+# Backup line by line padha jaata hai aur unordered bulk_write batches me likha jaata hai.
+# Har collection ka natural key hai, isliye ek hi file do baar restore karne par bhi
+# duplicate nahi banta (logs ka _id = uid|ts|score ka hash).
+RESTORE_BATCH = 1000
+RESTORE_STATUS_SECS = 3
+RESTORE_EXTS = ('.json', '.ndjson', '.ndjson.gz')
+
+def log_key(doc):
+    return hashlib.sha1(f"{doc.get('uid')}|{doc.get('ts')!r}|{doc.get('score')}".encode()).hexdigest()[:24]
+
+def restore_op(coll, doc):
+    # Galat / adhoora document ho to None (skip + invalid count)
+    try:
+        if coll == "users":
+            return users_col, ReplaceOne({"_id": doc['_id']}, doc, upsert=True)
+        if coll == "mistakes":
+            return mistakes_col, UpdateOne({"uid": doc['uid'], "qh": doc['qh']}, {"$set": doc}, upsert=True)
+        if coll == "questions":
+            doc['part'] = doc.get('part') or 0
+            key = chapter_key(doc['source'], doc['type'], doc['chapter'], doc['part'])
+            return questions_col, UpdateOne(key, {"$set": doc}, upsert=True)
+        if coll == "logs":
+            doc.pop('_id', None)
+            if not doc.get('uid') or 'ts' not in doc: return None
+            doc['at'] = datetime.utcfromtimestamp(doc['ts'])  # TTL ke liye asli Date chahiye
+            return logs_col, UpdateOne({"_id": log_key(doc)}, {"$setOnInsert": doc}, upsert=True)
+        if coll == "bank":
+            if not is_qid(doc.get('_id')) or not doc.get('q'): return None
+            return bank_col, ReplaceOne({"_id": doc['_id']}, doc, upsert=True)
+        if coll == "rollups":
+            if not doc.get('uid') or not doc.get('day'): return None
+            doc['_id'] = f"{doc['uid']}|{doc['day']}"
+            return rollups_col, ReplaceOne({"_id": doc['_id']}, doc, upsert=True)
+    except (KeyError, TypeError):
+        return None
+    return None
+
+def iter_backup(raw, file_name):
+    # (collection, document) pairs; naya NDJSON stream hota hai, purana .json ek dict
+    if file_name.endswith(('.ndjson', '.ndjson.gz')):
+        stream = gzip.GzipFile(fileobj=io.BytesIO(raw)) if file_name.endswith('.gz') else io.BytesIO(raw)
+        for line in stream:
+            if not line.strip(): continue
+            row = json.loads(line)
+            if row.get("c") != "_meta": yield row.get("c"), row.get("d")
+        return
+    data = json.loads(raw.decode('utf-8'))
+    for coll in ("users", "mistakes", "bank", "questions", "logs", "rollups"):
+        for doc in data.get(coll) or []: yield coll, doc
+
+def run_restore(raw, file_name, chat_id, status_msg_id, dry=False):
+    started, last_edit = time.time(), 0
+    counts, invalid, written = {}, 0, {"upserted": 0, "modified": 0}
+    pending, chapters, log_from = {}, set(), None
+
+    def flush(col):
+        ops = pending.pop(col.name, None)
+        if not ops or dry: return
+        res = col.bulk_write(ops, ordered=False)
+        written["upserted"] += res.upserted_count; written["modified"] += res.modified_count
+
+    def progress(head):
+        total = sum(counts.values())
+        return (f"{head}\n\n" + "\n".join(f"{k}: {v}" for k, v in counts.items()) +
+                f"\nInvalid: {invalid}\nSpeed: {total / max(time.time() - started, 0.001):.0f} docs/s")
+
+    try:
+        cols = {}
+        for coll, doc in iter_backup(raw, file_name):
+            op = restore_op(coll, doc) if isinstance(doc, dict) else None
+            if op is None:
+                invalid += 1; continue
+            col, write = op
+            counts[coll] = counts.get(coll, 0) + 1
+            if coll == "questions": chapters.add((doc['source'], doc['type'], doc['chapter']))
+            if coll == "logs": log_from = doc['ts'] if log_from is None else min(log_from, doc['ts'])
+            cols[col.name] = col
+            pending.setdefault(col.name, []).append(write)
+            if len(pending[col.name]) >= RESTORE_BATCH: flush(col)
+            if time.time() - last_edit >= RESTORE_STATUS_SECS:
+                try: bot.edit_message_text(progress("♻️ Restoring..." if not dry else "🧪 Validating..."), chat_id, status_msg_id)
+                except Exception: pass
+                last_edit = time.time()
+        for col in cols.values(): flush(col)
+        if chapters and not dry: bump_bank_version(sorted(chapters))
+        if log_from is not None and not dry: rollup_logs(since=log_from)  # Purane din ke rollups bhi sahi ho jayen
+        head = "✅ Dry Run OK (kuch likha nahi gaya)" if dry else "✅ **Restore Successful!**"
+        if not dry: head += f"\nUpserted: {written['upserted']} | Updated: {written['modified']}"
+        bot.edit_message_text(progress(head), chat_id, status_msg_id)
     except Exception as e:
-        bot.reply_to(message, f"❌ Backup Failed: {str(e)}")
+        bot.edit_message_text(f"❌ Restore Failed: {e}\n\n" + progress("Progress:"), chat_id, status_msg_id)
 
 
 @bot.message_handler(content_types=['document'])
@@ -264,15 +1598,12 @@ def handle_docs(message):
         downloaded = bot.download_file(file_info.file_path)
         
         # --- 1. RESTORE LOGIC ---
-        if message.caption == '/restore' and message.document.file_name.endswith('.json'):
-            data = json.loads(downloaded.decode('utf-8'))
-            if 'users' in data:
-                for u in data['users']: users_col.replace_one({"_id": u['_id']}, u, upsert=True)
-            if 'questions' in data:
-                for q in data['questions']: questions_col.update_one({"source": q['source'], "type": q['type'], "chapter": q['chapter']}, {"$set": q}, upsert=True)
-            if 'logs' in data and len(data['logs']) > 0:
-                logs_col.insert_many(data['logs'])
-            bot.reply_to(message, "✅ **Restore Successful!**")
+        caption = (message.caption or '').split()
+        if caption[:1] == ['/restore'] and message.document.file_name.endswith(RESTORE_EXTS):
+            dry = 'dry' in caption[1:]
+            status = bot.reply_to(message, "🧪 Validating backup..." if dry else "♻️ Restoring...")
+            threading.Thread(target=run_restore, daemon=True,
+                             args=(downloaded, message.document.file_name, message.chat.id, status.message_id, dry)).start()
             return
             
         # --- 2. 👽 ALIAN 2.0 (DIRECT JSON UPLOAD) ---
@@ -281,81 +1612,13 @@ def handle_docs(message):
                 bot.reply_to(message, "❌ **Caption Missing!**\n\nExample: `Alian 2.0 | Botany | Cell Biology`")
                 return
             
-            data = json.loads(downloaded.decode('utf-8'))
             parts = [p.strip() for p in message.caption.split('|')]
             source = parts[0] if len(parts) > 0 else "Alian 2.0"
             typ = parts[1] if len(parts) > 1 else "Subject"
             chapter = parts[2] if len(parts) > 2 else f"Test_{int(time.time())}"
-            
-            questions = []
-            seen_ids = set() # Asli Unique ID store karne ke liye
-            
-            # Text Clean Logic
-            def clean_html(text):
-                if not text: return ""
-                text = str(text)
-                if text.startswith('"') and text.endswith('"'):
-                    try: text = json.loads(text)
-                    except: text = text[1:-1]
-                text = text.replace('\\/', '/').replace('\\"', '"')
-                text = text.replace('\\n', '<br>').replace('\\t', '&nbsp;&nbsp;&nbsp;')
-                return text.strip()
-
-            # Single Question Extractor
-            def parse_q(q_node, parent_node):
-                try:
-                    # Parent aur Node dono jagah se ID dhoondhne ki koshish
-                    q_id = parent_node.get('id') or parent_node.get('unique_identifier') or q_node.get('id')
-                    # Difficulty bhi bahar hoti hai
-                    diff = parent_node.get('difficulty') or q_node.get('difficulty', 'EASY')
-                    
-                    raw_text = q_node.get('qns_content', {}).get('text', '')
-                    cleaned_q = clean_html(raw_text)
-                    
-                    if not q_id: q_id = cleaned_q # Backup
-                    
-                    if q_id not in seen_ids and cleaned_q:
-                        seen_ids.add(q_id)
-                        opts = [clean_html(opt.get('text', '')) for opt in q_node.get('options', [])]
-                        
-                        ans_index = 0
-                        ans_str = q_node.get('answer') or parent_node.get('answer', '[]')
-                        if ans_str and str(ans_str).strip() not in ['[]', '""', 'null', 'None']:
-                            try:
-                                ans_list = json.loads(str(ans_str)) 
-                                if len(ans_list) > 0: ans_index = int(ans_list[0])
-                            except: pass
-                        
-                        # 2 ya usse zyada options wale sab save karo (True/False ko bhi include karega)
-                        if len(opts) >= 2: 
-                            questions.append({"q": cleaned_q, "opts": opts[:4], "ans": ans_index, "diff": diff})
-                except Exception as e:
-                    print(f"Extraction error: {e}")
-
-            # Smart Recursive Searcher
-            def search_for_questions(node):
-                if isinstance(node, dict):
-                    # Scenario 1: Agar questions 'content' dabbe ke andar hain (Result JSON)
-                    if 'content' in node and isinstance(node['content'], dict) and 'qns_content' in node['content']:
-                        parse_q(node['content'], parent_node=node)
-                    # Scenario 2: Agar direct questions hain (Question JSON)
-                    elif 'qns_content' in node and 'options' in node:
-                        parse_q(node, parent_node=node)
-                    else:
-                        for k, v in node.items(): search_for_questions(v)
-                elif isinstance(node, list):
-                    for item in node: search_for_questions(item)
-            
-            # Function ko start karo
-            search_for_questions(data)
-                    
-            if len(questions) > 0:
-                filter_q = {"source": source, "type": typ, "chapter": chapter}
-                update_q = {"$set": {"source": source, "type": typ, "chapter": chapter, "mode": "alian", "data": questions}}
-                questions_col.update_one(filter_q, update_q, upsert=True)
-                bot.reply_to(message, f"👽 **ALIAN 2.0 Uploaded Successfully!**\n\n📁 Path: {source} -> {typ} -> {chapter}\n✅ Total Questions Saved: {len(questions)}")
-            else:
-                bot.reply_to(message, "❌ Invalid JSON! Koi valid questions nahi mile.")
+            # Parse + write background me, bot thread free rahe
+            threading.Thread(target=run_alian_ingest, daemon=True,
+                             args=(downloaded, source, typ, chapter, message.chat.id, message.message_id)).start()
             return
 
         # --- 3. OLD LOGIC (.txt file upload for Allen) ---
@@ -365,111 +1628,484 @@ def handle_docs(message):
             bot.reply_to(message, data_q)
             return
 
-        filter_q = {"source": meta['source'], "type": meta['type'], "chapter": meta['chapter']}
-        update_q = {"$set": {"source": meta['source'], "type": meta['type'], "chapter": meta['chapter'], "mode": meta['mode'], "data": data_q}}
-        questions_col.update_one(filter_q, update_q, upsert=True)
-        bot.reply_to(message, f"☁️ Saved: {meta['chapter']} ({len(data_q)} Qs)")
+        saved = save_chapter(meta['source'], meta['type'], meta['chapter'], meta['mode'], data_q)
+        bump_bank_version([(meta['source'], meta['type'], meta['chapter'])])
+        bot.reply_to(message, f"☁️ Saved: {meta['chapter']} ({saved['saved']} Qs)\n"
+                              f"🔁 Duplicates: {saved['duplicates']} | 📚 Already in bank: {saved['in_bank']}")
 
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {e}")
 
+# ==========================================
+# 📄 MISTAKES PDF REPORTS (Background Workers)
+# ==========================================
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", 2))
+REPORT_QUEUE_MAX = int(os.getenv("REPORT_QUEUE_MAX", 200))
+REPORT_RETRIES = 3
+REPORT_DEDUPE_SECS = 600
+REPORT_CAPTION = "🚨 **Your Quiz Analytics**\n\nHere is a PDF of the questions you got wrong. Review them to improve your weak spots!"
+
+def render_mistakes_pdf(mistakes):
+    from fpdf import FPDF  # Lazy: cold start par fpdf load nahi hota
+    # Disk par file nahi, seedha memory me PDF bytes
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+    
+    # Title
+    pdf.set_font("Arial", 'B', 16)
+    pdf.cell(200, 10, txt="Quiz Mistakes Report", ln=True, align='C')
+    pdf.set_font("Arial", size=12)
+    pdf.ln(10)
+    
+    # Write Questions
+    for idx, m in enumerate(mistakes):
+        # Using encode/decode to avoid Unicode errors with FPDF
+        q_text = f"Q{idx+1}: {m['q']}".encode('latin-1', 'replace').decode('latin-1')
+        pdf.set_font("Arial", 'B', 11)
+        pdf.multi_cell(0, 10, txt=q_text)
+        
+        pdf.set_font("Arial", size=10)
+        for i, opt in enumerate(m.get('opts', [])):
+            prefix = "[ CORRECT ] " if i == m.get('ans') else " - "
+            opt_text = f"{prefix}{opt}".encode('latin-1', 'replace').decode('latin-1')
+            pdf.multi_cell(0, 8, txt=opt_text)
+        pdf.ln(5)
+    
+    out = pdf.output(dest='S')
+    return out.encode('latin-1') if isinstance(out, str) else bytes(out)
+
+class ReportQueue:
+    """Bounded queue + worker pool that renders mistake PDFs and uploads them to Telegram."""
+
+    def __init__(self, workers, maxsize):
+        self.workers = workers
+        self._q = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._recent = {}  # (uid, quiz hash) -> time, same quiz ki report dobara nahi
+        self._started = False
+        self.counts = {"queued": 0, "sent": 0, "failed": 0, "dropped": 0, "deduped": 0, "retries": 0}
+        self.render_ms = deque(maxlen=200)
+        self.upload_ms = deque(maxlen=200)
+
+    def submit(self, uid, mistakes):
+        key = (uid, hashlib.sha1("|".join(sorted(m.get('id') or question_id(m) for m in mistakes)).encode()).hexdigest())
+        now = time.time()
+        with self._lock:
+            self._recent = {k: t for k, t in self._recent.items() if now - t < REPORT_DEDUPE_SECS}
+            if key in self._recent:
+                self.counts["deduped"] += 1
+                return False
+            self._recent[key] = now
+            if not self._started:
+                for _ in range(self.workers):
+                    threading.Thread(target=self._worker, daemon=True).start()
+                self._started = True
+        try:
+            self._q.put_nowait((uid, mistakes))
+            self.counts["queued"] += 1
+            return True
+        except queue.Full:
+            self.counts["dropped"] += 1
+            return False
+
+    def depth(self):
+        return self._q.qsize()
+
+    def _worker(self):
+        while True:
+            uid, mistakes = self._q.get()
+            try:
+                t0 = time.perf_counter()
+                data = render_mistakes_pdf(mistakes)
+                self.render_ms.append((time.perf_counter() - t0) * 1000)
+                PDF_SECONDS.observe(time.perf_counter() - t0)
+                self._upload(uid, data)
+            except Exception as e:
+                self.counts["failed"] += 1
+                print(f"PDF Error: {e}")
+            finally:
+                self._q.task_done()
+
+    def _upload(self, uid, data):
+        file_name = f"Mistakes_{uid}_{int(time.time())}.pdf"
+        for attempt in range(REPORT_RETRIES):
+            try:
+                t0 = time.perf_counter()
+                bot.send_document(uid, io.BytesIO(data), visible_file_name=file_name,
+                                  caption=REPORT_CAPTION, parse_mode="Markdown")
+                self.upload_ms.append((time.perf_counter() - t0) * 1000)
+                self.counts["sent"] += 1
+                return
+            except telebot.apihelper.ApiTelegramException as e:
+                if e.error_code == 403: raise  # User ne bot block kiya hai, retry bekaar
+                wait = (e.result_json or {}).get('parameters', {}).get('retry_after') or 2 ** attempt
+            except Exception:
+                wait = 2 ** attempt
+            if attempt + 1 < REPORT_RETRIES:
+                self.counts["retries"] += 1
+                time.sleep(wait)
+        raise RuntimeError(f"Upload failed after {REPORT_RETRIES} tries")
+
+    def stats(self):
+        avg = lambda xs: round(sum(xs) / len(xs), 1) if xs else 0
+        return dict(self.counts, depth=self.depth(),
+                    render_ms=avg(self.render_ms), upload_ms=avg(self.upload_ms))
+
+report_queue = ReportQueue(REPORT_WORKERS, REPORT_QUEUE_MAX)
+
+# ==========================================
+# 🏆 LEADERBOARD (Materialized Boards)
+# ==========================================
+# Daily/Weekly boards har sync par $inc se update hote hain (score log batch ke sath),
+# isliye request par score_logs ka aggregation nahi chalta. All-time = users.xp.
+LB_TZ_OFFSET = int(os.getenv("LB_TZ_OFFSET", 19800))  # IST (+5:30) ke hisaab se din/hafta
+LB_CACHE_SECS = 15
+LB_TOP = 100
+LB_HIST_SECS = int(os.getenv("LB_HIST_SECS", 60))  # Rank histogram itni der purana chal jaata hai
+
+lb_cache = TTLCache(LB_CACHE_SECS)
+rank_hist = TTLCache(LB_HIST_SECS, max_items=16)
+_hist_lock = threading.Lock()
+
+def board_window(kind, ts=None):
+    # Board ka naam, start ts aur kab tak rakhna hai (expire_at)
+    ts = time.time() if ts is None else ts
+    local = datetime.utcfromtimestamp(ts + LB_TZ_OFFSET).date()
+    if kind == 'daily':
+        start_day, span, keep, name = local, 1, 2, f"daily:{local.isoformat()}"
+    else:
+        year, week, _ = local.isocalendar()
+        start_day, span, keep, name = local - timedelta(days=local.weekday()), 7, 14, f"weekly:{year}-W{week:02d}"
+    start = calendar.timegm(start_day.timetuple()) - LB_TZ_OFFSET
+    return name, start, datetime.utcfromtimestamp(start + (span + keep) * 86400)
+
+def board_key(kind):
+    return 'all' if kind == 'all' else board_window(kind)[0]
+
+def leaderboard_ops(logs):
+    # Score logs ke batch ko daily + weekly boards ke $inc me badlo (uid per board ek op)
+    totals = {}
+    for log in logs:
+        for kind in ('daily', 'weekly'):
+            name, _, expire_at = board_window(kind, log['ts'])
+            entry = totals.setdefault((name, log['uid']), {"score": 0, "name": log['name'], "expire_at": expire_at})
+            entry["score"] += log['score']; entry["name"] = log['name']
+    return [UpdateOne({"board": board, "uid": uid},
+                      {"$inc": {"score": e["score"]}, "$set": {"name": e["name"]},
+                       "$setOnInsert": {"expire_at": e["expire_at"]}}, upsert=True)
+            for (board, uid), e in totals.items()]
+
+def load_top(kind, board):
+    if kind == 'all':
+        top_cursor = users_col.find({}, {"name": 1, "xp": 1}).sort("xp", -1).limit(LB_TOP)
+        rows = [{"rank": i+1, "name": u.get('name'), "score": u.get('xp', 0), "uid": u['_id']} for i, u in enumerate(top_cursor)]
+        return with_grades(rows, [r['score'] for r in rows])
+    top_cursor = boards_col.find({"board": board}, {"_id": 0, "uid": 1, "name": 1, "score": 1}).sort("score", -1).limit(LB_TOP)
+    rows = [{"rank": i+1, "name": r.get('name'), "score": r['score'], "uid": r['uid']} for i, r in enumerate(top_cursor)]
+    # Daily/weekly score board ka hai, grade user ke total xp se (ek $in query)
+    xp = {u['_id']: u.get('xp', 0) for u in users_col.find({"_id": {"$in": [r['uid'] for r in rows]}}, {"xp": 1})}
+    return with_grades(rows, [xp.get(r['uid'], 0) for r in rows])
+
+def with_grades(rows, xps):
+    for row, stats in zip(rows, grade_stats_batch(xps)):
+        row["grade"], row["grade_percent"] = stats["grade"], round(stats["percent"], 1)
+    return rows
+
+def score_histogram(kind, board):
+    """Sorted distinct scores of a board plus prefix counts; rebuilt at most every LB_HIST_SECS."""
+    key = (kind, board)
+    hist = rank_hist.get(key)
+    if hist is not None: return hist
+    with _hist_lock:  # Expire par ek hi thread dobara banaye
+        hist = rank_hist.get(key)
+        if hist is None:
+            col, field, match = (users_col, "$xp", {}) if kind == 'all' else (boards_col, "$score", {"board": board})
+            rows = sorted((r['_id'], r['n']) for r in col.aggregate([
+                {"$match": match}, {"$group": {"_id": {"$ifNull": [field, 0]}, "n": {"$sum": 1}}}]))
+            prefix = list(itertools.accumulate((n for _, n in rows), initial=0))
+            hist = ([score for score, _ in rows], prefix)
+            rank_hist.set(key, hist)
+    return hist
+
+def rank_of(kind, board, uid):
+    # Rank = (mujhse zyada score wale) + 1. count_documents({"score": {"$gt": s}}) index par bhi
+    # O(rank) keys scan karta hai (rank 100k = 100k keys har hit par), isliye distinct-score
+    # histogram ke prefix sum par bisect: O(log d). Histogram LB_HIST_SECS tak purana ho sakta hai.
+    if kind == 'all':
+        doc = users_col.find_one({"_id": uid}, {"name": 1, "xp": 1})
+        if not doc: return None
+        score = xp = doc.get('xp', 0)
+    else:
+        doc = boards_col.find_one({"board": board, "uid": uid}, {"name": 1, "score": 1})
+        if not doc: return None
+        score = doc['score']
+        xp = (users_col.find_one({"_id": uid}, {"xp": 1}) or {}).get('xp', 0)
+    scores, prefix = score_histogram(kind, board)
+    ahead = prefix[-1] - prefix[bisect.bisect_right(scores, score)]
+    stats = calculate_grade_stats(xp)
+    return {"rank": ahead + 1, "name": doc.get('name'), "score": score, "uid": uid,
+            "grade": stats["grade"], "grade_percent": round(stats["percent"], 1)}
+
+def rebuild_leaderboards():
+    # Current din/hafte ke boards rollups se dobara banao (deploy ke baad ya gadbad hone par)
+    rollup_logs(cutoff=time.time())  # Aaj tak ke logs pehle fold kar lo
+    counts = {}
+    for kind in ('daily', 'weekly'):
+        name, start, expire_at = board_window(kind)
+        rows = rollups_col.aggregate([{"$match": {"day": {"$gte": local_day(start)}}},
+                                      {"$sort": {"day": 1}},
+                                      {"$group": {"_id": "$uid", "name": {"$last": "$name"}, "total": {"$sum": "$score"}}}])
+        ops = [UpdateOne({"board": name, "uid": r['_id']},
+                         {"$set": {"score": r['total'], "name": r['name'], "expire_at": expire_at}}, upsert=True) for r in rows]
+        if ops: boards_col.bulk_write(ops, ordered=False)
+        counts[name] = len(ops)
+    return counts
+
+@bot.message_handler(commands=['rebuild_lb'])
+def rebuild_lb_command(message):
+    if str(message.from_user.id) != str(ADMIN_ID): return
+    try:
+        counts = rebuild_leaderboards()
+        bot.reply_to(message, "✅ Leaderboards Rebuilt!\n\n" + "\n".join(f"{k}: {v} users" for k, v in counts.items()))
+    except Exception as e:
+        bot.reply_to(message, f"❌ Rebuild Failed: {e}")
+
+# ==========================================
+# 🗃️ SCORE LOG RETENTION (TTL + Daily Rollups)
+# ==========================================
+# Raw score_logs sirf LOG_RETENTION_DAYS tak rehte hain (`at` par TTL index). Usse pehle
+# ek job unhe per-user per-day rollup (score_rollups) me fold kar deta hai; leaderboard
+# rebuild aur backup rollups padhte hain. Job har baar watermark wale din se poore din
+# dobara banata hai ($merge replace), isliye crash/dobara chalne par double count nahi.
+LOG_RETENTION_DAYS = max(2, int(os.getenv("LOG_RETENTION_DAYS", 30)))
+ROLLUP_EVERY_SECS = int(os.getenv("ROLLUP_EVERY_SECS", 600))
+ROLLUP_LAG_SECS = 60  # Writer buffer (LOG_FLUSH_SECS) se zyada, taaki aakhri logs chhoot na jayen
+BACKUP_RAW_LOGS = os.getenv("BACKUP_RAW_LOGS") == "1"
+
+def local_day(ts):
+    return datetime.utcfromtimestamp(ts + LB_TZ_OFFSET).date().isoformat()
+
+def day_start_ts(ts):
+    # `ts` wale local din ki shuruaat (epoch secs)
+    day = datetime.strptime(local_day(ts), "%Y-%m-%d")
+    return calendar.timegm(day.timetuple()) - LB_TZ_OFFSET
+
+def ensure_log_ttl():
+    secs = LOG_RETENTION_DAYS * 86400
+    try:
+        logs_col.create_index([("at", 1)], expireAfterSeconds=secs)
+    except OperationFailure as e:
+        if e.code != 85: raise  # IndexOptionsConflict: retention badla hai, index update karo
+        get_db().command("collMod", logs_col.name, index={"keyPattern": {"at": 1}, "expireAfterSeconds": secs})
+
+def backfill_log_dates(limit=5000):
+    # Purane logs me `at` nahi hai, unke bina TTL kabhi expire nahi karega
+    ids = [d['_id'] for d in logs_col.find({"at": {"$exists": False}}, {"_id": 1}).limit(limit)]
+    if ids:
+        logs_col.update_many({"_id": {"$in": ids}}, [{"$set": {"at": {"$toDate": {"$multiply": ["$ts", 1000]}}}}])
+    return len(ids)
+
+def rollup_logs(since=None, cutoff=None):
+    """Fold raw logs into score_rollups for every local day from `since` (default: watermark) up to `cutoff`."""
+    mark = meta_col.find_one({"_id": "rollup"}) or {}
+    since = mark.get("upto", 0) if since is None else min(since, mark.get("upto", since))
+    cutoff = time.time() - ROLLUP_LAG_SECS if cutoff is None else cutoff
+    start = day_start_ts(since)  # Poora din dobara, aadha nahi
+    day_expr = {"$dateToString": {"format": "%Y-%m-%d",
+                                  "date": {"$toDate": {"$multiply": [{"$add": ["$ts", LB_TZ_OFFSET]}, 1000]}}}}
+    logs_col.aggregate([
+        {"$match": {"ts": {"$gte": start, "$lt": cutoff}}},
+        {"$sort": {"ts": 1}},
+        {"$group": {"_id": {"uid": "$uid", "day": day_expr}, "name": {"$last": "$name"},
+                    "score": {"$sum": "$score"}, "quizzes": {"$sum": 1}, "first_ts": {"$min": "$ts"}}},
+        {"$project": {"_id": {"$concat": [{"$toString": "$_id.uid"}, "|", "$_id.day"]}, "uid": "$_id.uid",
+                      "day": "$_id.day", "name": 1, "score": 1, "quizzes": 1, "first_ts": 1}},
+        {"$merge": {"into": rollups_col.name, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ])
+    upto = min(cutoff, time.time() - ROLLUP_LAG_SECS)  # Der se flush hue logs agli baar phir dikhenge
+    if upto > mark.get("upto", 0):
+        meta_col.update_one({"_id": "rollup"}, {"$set": {"upto": upto, "ran_at": time.time()}}, upsert=True)
+    return upto
+
+class RollupJob:
+    def __init__(self, every):
+        self.every = every
+        self.runs = self.errors = self.backfilled = 0
+        self.last_ms = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            t0 = time.perf_counter()
+            try:
+                rollup_logs()  # Pehle fold, phir `at` - warna TTL bina rollup ke uda sakta hai
+                self.backfilled += backfill_log_dates()
+                self.runs += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Rollup error: {e}")
+            self.last_ms = round((time.perf_counter() - t0) * 1000)
+            time.sleep(self.every)
+
+    def stats(self):
+        mark = (meta_col.find_one({"_id": "rollup"}) or {}) if db_connected else {}
+        lag = round(time.time() - mark["upto"]) if mark.get("upto") else None
+        return {"runs": self.runs, "errors": self.errors, "backfilled": self.backfilled,
+                "last_ms": self.last_ms, "lag": lag}
+
+rollup_job = RollupJob(ROLLUP_EVERY_SECS)
+
 # ==========================================
 # 🌐 API ROUTES (UNCHANGED)
 # ==========================================
 @app.route('/')
-def index(): return render_template('quiz.html')
+def index(): return payload_response(index_page(), mimetype='text/html')
+
+_index_entry = None
+
+def index_page():
+    # quiz.html static hai: ek baar render + gzip/br + ETag, phir har hit par wahi bytes
+    global _index_entry
+    if _index_entry is None or app.debug:
+        with app.app_context():
+            body = render_template('quiz.html').encode('utf-8')
+        _index_entry = encode_body(body, "html")
+    return _index_entry
 
 @app.route('/api/get_data')
 def get_data():
     if not db_connected: return jsonify({})
-    all_docs = questions_col.find({}, {"_id": 0})
+    return cached_json(("get_data",), build_full_tree)
+
+def build_full_tree():
+    all_docs = questions_col.find({}, {"_id": 0}).sort([("source", 1), ("type", 1), ("chapter", 1), ("part", 1)])
     tree = {}
     for doc in all_docs:
         src, typ, chap = doc['source'], doc['type'], doc['chapter']
         mode = doc.get('mode', 'normal') # Mode nikal rahe hain
         if src not in tree: tree[src] = {}
         if typ not in tree[src]: tree[src][typ] = {}
-        # Yahan structure change kiya hai taaki data aur mode dono jayein
-        tree[src][typ][chap] = {"data": doc['data'], "mode": mode} 
-    return jsonify(tree)
+        # Yahan structure change kiya hai taaki data aur mode dono jayein; parts jud jaate hain
+        entry = tree[src][typ].setdefault(chap, {"data": [], "mode": mode})
+        entry["data"].extend(resolve_questions(doc.get('qids') or doc.get('data') or []))
+    return tree
+
+# --- LAZY QUESTION BANK (Index + Chapter Pages) ---
+CHAPTER_PAGE_SIZE = 200
+CHAPTER_PAGE_MAX = 500
+
+@app.route('/api/get_index')
+def get_index():
+    # Sirf source -> type -> chapter ka dhaancha, questions nahi (count + mode only)
+    if not db_connected: return jsonify({})
+    return cached_json(("index",), build_index)
+
+def build_index():
+    pipeline = [{"$group": {"_id": {"source": "$source", "type": "$type", "chapter": "$chapter"},
+                            "mode": {"$first": "$mode"},
+                            "count": {"$sum": {"$size": CHAPTER_ITEMS}}}}]
+    tree = {}
+    for doc in questions_col.aggregate(pipeline):
+        key = doc['_id']
+        chapters = tree.setdefault(key['source'], {}).setdefault(key['type'], {})
+        chapters[key['chapter']] = {"count": doc['count'], "mode": doc.get('mode') or 'normal'}
+    return tree
+
+@app.route('/api/chapter')
+def get_chapter():
+    # Ek chapter ke questions, page by page (?source=&type=&chapter=&page=1&size=200)
+    if not db_connected: return jsonify({"error": "No DB"})
+    src, typ, chap = request.args.get('source'), request.args.get('type'), request.args.get('chapter')
+    if not src or not typ or not chap: return jsonify({"error": "Missing source/type/chapter"})
+    page = max(1, request.args.get('page', 1, type=int))
+    size = min(max(1, request.args.get('size', CHAPTER_PAGE_SIZE, type=int)), CHAPTER_PAGE_MAX)
+    return cached_json(("chapter", src, typ, chap, page, size), lambda: build_chapter_page(src, typ, chap, page, size))
+
+def build_chapter_page(src, typ, chap, page, size):
+    skip = (page - 1) * size
+    # Pehle har part ka count (sasta), phir sirf wahi parts slice karo jo is page me aate hain
+    match = {"source": src, "type": typ, "chapter": chap}
+    parts = list(questions_col.aggregate([
+        {"$match": match},
+        {"$project": {"_id": 1, "part": 1, "mode": 1, "count": {"$size": CHAPTER_ITEMS}}},
+        {"$sort": {"part": 1}}]))
+    if not parts: return {"error": "Chapter not found"}
+    total, offset, data = sum(p['count'] for p in parts), 0, []
+    for p in parts:
+        lo, hi = max(skip, offset), min(skip + size, offset + p['count'])
+        if lo < hi:
+            window = {"$slice": [lo - offset, hi - lo]}
+            doc = questions_col.find_one({"_id": p['_id']}, {"_id": 0, "qids": window, "data": window})
+            data.extend(resolve_questions(doc.get('qids') or doc.get('data') or []))
+        offset += p['count']
+    return {
+        "data": data,
+        "mode": parts[0].get('mode', 'normal'),
+        "page": page,
+        "size": size,
+        "total": total,
+        "has_more": skip + len(data) < total
+    }
 
 @app.route('/api/user/sync', methods=['POST'])
+@members_only
 def sync_user():
     if not db_connected: return jsonify({"error": "No DB"})
     data = request.json
-    uid, name = str(data.get('id')), data.get('name')
+    uid, name = str(g.get('uid') or data.get('id')), data.get('name')
     score_add = int(data.get('add_score', 0))
-    mistakes = data.get('mistakes', [])
-    solved = data.get('solved', [])
-    
-    user = users_col.find_one({"_id": uid})
-    if not user: 
-        user = {"_id": uid, "name": name, "xp": 0, "mistakes": []}
-        users_col.insert_one(user)
+    mistakes = data.get('mistakes') or []
+    solved = data.get('solved') or []
     
-    new_xp = max(0, user.get('xp', 0) + score_add)
+    # 1) Mistakes apne collection me: naye upsert, solved delete (ek bulk round trip)
+    # Question ID (16 char) se pehchan; lambe HTML text ka hash/compare nahi
+    fresh, seen = [], set()
+    for m in mistakes:
+        if not m.get('q'): continue
+        qid = m['id'] if is_qid(m.get('id')) else question_id(m)
+        if qid not in seen:
+            seen.add(qid); fresh.append(dict(m, id=qid))
+    solved_ids = list({s for s in solved if is_qid(s)})
+    solved_texts = [s for s in solved if isinstance(s, str) and not is_qid(s)]  # Purana client text bhejta hai
+    new_mistakes_for_pdf, removed = [], 0
+    ops = [UpdateOne({"uid": uid, "qh": m['id']}, {"$setOnInsert": mistake_doc(uid, m)}, upsert=True) for m in fresh]
+    if solved_ids or solved_texts:
+        ops.append(DeleteMany({"uid": uid, "$or": [{"qh": {"$in": solved_ids}}, {"q": {"$in": solved_texts}}]}))
+    if ops:
+        res = mistakes_col.bulk_write(ops, ordered=True)
+        # PDF sirf un mistakes ka jo pehle se saved nahi thi
+        new_mistakes_for_pdf = [fresh[i] for i in sorted(res.upserted_ids)]
+        removed = res.deleted_count
+
+    # 2) User: upsert + xp clamp + mistake_count, atomic, naya document wapas
+    user = users_col.find_one_and_update(
+        {"_id": uid},
+        [{"$set": {
+            "name": name,
+            "xp": {"$max": [0, {"$add": [{"$ifNull": ["$xp", 0]}, score_add]}]},
+            "mistake_count": {"$max": [0, {"$add": [{"$ifNull": ["$mistake_count", 0]},
+                                                    len(new_mistakes_for_pdf) - removed]}]},
+        }}],
+        projection={"xp": 1, "mistake_count": 1, "mistakes": {"$slice": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    if 'mistakes' in user:
+        user['mistake_count'] = migrate_legacy_mistakes(uid)
+    new_xp = user['xp']
     if score_add > 0: 
-        logs_col.insert_one({"uid": uid, "name": name, "score": score_add, "ts": time.time()})
+        log = {"uid": uid, "name": name, "score": score_add, "ts": time.time()}
+        score_log_writer.add(dict(log, _id=log_key(log), at=datetime.utcfromtimestamp(log['ts'])))
     
-    curr_mistakes = user.get('mistakes', [])
-    exist = {m['q'] for m in curr_mistakes}
-    
-    # PDF ban banane ke liye current quiz ki mistakes ko alag se filter karna
-    new_mistakes_for_pdf = []
-    
-    for m in mistakes: 
-        if m['q'] not in exist: 
-            curr_mistakes.append(m)
-            new_mistakes_for_pdf.append(m)
-            
-    if solved: 
-        curr_mistakes = [m for m in curr_mistakes if m['q'] not in solved]
-        
-    users_col.update_one({"_id": uid}, {"$set": {"xp": new_xp, "name": name, "mistakes": curr_mistakes}})
-    
-    # =======================================
-    # 📄 PDF GENERATION & SEND LOGIC
-    # =======================================
+    # PDF background worker banayega aur bhejega; response DB write ke turant baad
     if new_mistakes_for_pdf:
-        try:
-            pdf = FPDF()
-            pdf.add_page()
-            pdf.set_font("Arial", size=12)
-            
-            # Title
-            pdf.set_font("Arial", 'B', 16)
-            pdf.cell(200, 10, txt="Quiz Mistakes Report", ln=True, align='C')
-            pdf.set_font("Arial", size=12)
-            pdf.ln(10)
-            
-            # Write Questions
-            for idx, m in enumerate(new_mistakes_for_pdf):
-                # Using encode/decode to avoid Unicode errors with FPDF
-                q_text = f"Q{idx+1}: {m['q']}".encode('latin-1', 'replace').decode('latin-1')
-                pdf.set_font("Arial", 'B', 11)
-                pdf.multi_cell(0, 10, txt=q_text)
-                
-                pdf.set_font("Arial", size=10)
-                for i, opt in enumerate(m['opts']):
-                    prefix = "[ CORRECT ] " if i == m['ans'] else " - "
-                    opt_text = f"{prefix}{opt}".encode('latin-1', 'replace').decode('latin-1')
-                    pdf.multi_cell(0, 8, txt=opt_text)
-                pdf.ln(5)
-                
-            # Save and Send
-            file_name = f"Mistakes_{uid}_{int(time.time())}.pdf"
-            pdf.output(file_name)
-            
-            with open(file_name, 'rb') as f:
-                bot.send_document(
-                    uid, 
-                    f, 
-                    caption="🚨 **Your Quiz Analytics**\n\nHere is a PDF of the questions you got wrong. Review them to improve your weak spots!",
-                    parse_mode="Markdown"
-                )
-            os.remove(file_name) # Cleanup
-        except Exception as e:
-            print(f"PDF Error: {e}")
+        report_queue.submit(uid, new_mistakes_for_pdf)
 
     stats = calculate_grade_stats(new_xp)
     return jsonify({
@@ -477,31 +2113,61 @@ def sync_user():
         "current_xp": stats['current_xp'], 
         "req_xp": stats['req_xp'], 
         "percent": stats['percent'], 
-        "mistake_count": len(curr_mistakes), 
-        "mistakes_list": curr_mistakes
+        "mistake_count": user['mistake_count'], 
+        "mistakes_added": len(new_mistakes_for_pdf),
+        "mistakes_removed": removed
     })
 
+# --- MISTAKES STORE ---
+MISTAKE_PAGE_SIZE = 100
+
+def mistake_doc(uid, m):
+    qid = m['id'] if is_qid(m.get('id')) else question_id(m)
+    return {"uid": uid, "qh": qid, "qv": 2, "q": m['q'], "opts": m.get('opts', []),
+            "ans": m.get('ans', 0), "diff": m.get('diff'), "ts": time.time()}
+
+def migrate_legacy_mistakes(uid):
+    # Purane users ka embedded 'mistakes' array ek baar mistakes collection me shift karo
+    doc = users_col.find_one({"_id": uid}, {"mistakes": 1})
+    legacy = [m for m in (doc or {}).get('mistakes') or [] if m.get('q')]
+    if legacy:
+        mistakes_col.bulk_write([UpdateOne({"uid": uid, "qh": question_id(m)},
+                                           {"$setOnInsert": mistake_doc(uid, m)}, upsert=True) for m in legacy],
+                                ordered=False)
+    count = mistakes_col.count_documents({"uid": uid})
+    users_col.update_one({"_id": uid}, {"$unset": {"mistakes": "", "last_new_q": ""}, "$set": {"mistake_count": count}})
+    return count
+
+@app.route('/api/user/mistakes')
+@members_only
+def user_mistakes():
+    # Review / mistake practice ke liye paged list (?uid=&page=1&size=100), latest pehle
+    if not db_connected: return jsonify({"error": "No DB"})
+    uid = str(g.get('uid') or request.args.get('uid'))
+    page = max(1, request.args.get('page', 1, type=int))
+    size = min(max(1, request.args.get('size', MISTAKE_PAGE_SIZE, type=int)), CHAPTER_PAGE_MAX)
+    cursor = mistakes_col.find({"uid": uid}, {"_id": 0, "uid": 0}).sort("ts", -1).skip((page - 1) * size).limit(size + 1)
+    items = [dict(m, id=m.get('qh')) for m in cursor]
+    return jsonify({"data": items[:size], "page": page, "size": size, "has_more": len(items) > size})
+
 
 
 @app.route('/api/leaderboard/<filter>')
 def leaderboard(filter):
     if not db_connected: return jsonify({"top": [], "user": None})
-    uid_req = request.args.get('uid'); now = time.time(); pipeline = []
-    if filter == 'daily': pipeline.append({"$match": {"ts": {"$gt": now - 86400}}})
-    elif filter == 'weekly': pipeline.append({"$match": {"ts": {"$gt": now - 604800}}})
-    
-    if filter == 'all':
-        top_cursor = users_col.find().sort("xp", -1).limit(100)
-        top_100 = [{"rank": i+1, "name": u['name'], "score": u.get('xp', 0), "uid": u['_id']} for i, u in enumerate(top_cursor)]
-    else:
-        pipeline.extend([{"$group": {"_id": "$uid", "name": {"$first": "$name"}, "total": {"$sum": "$score"}}}, {"$sort": {"total": -1}}, {"$limit": 100}])
-        results = list(logs_col.aggregate(pipeline))
-        top_100 = [{"rank": i+1, "name": r['name'], "score": r['total'], "uid": r['_id']} for i, r in enumerate(results)]
+    uid_req = request.args.get('uid')
+    kind = filter if filter in ('daily', 'weekly') else 'all'
+    board = board_key(kind)
+    top_100 = lb_cache.get(board)
+    if top_100 is None:
+        top_100 = load_top(kind, board)
+        lb_cache.set(board, top_100)
     
     user_rank = None
     if uid_req:
         for u in top_100:
             if u['uid'] == uid_req: user_rank = u; break
+        if user_rank is None: user_rank = rank_of(kind, board, uid_req)  # Top 100 ke bahar wale bhi
     return jsonify({"top": top_100, "user": user_rank})
 
 @app.route('/api/admin/delete', methods=['POST'])
@@ -513,7 +2179,8 @@ def delete_item():
     try:
         if len(path) == 0: questions_col.delete_many({"source": target})
         elif len(path) == 1: questions_col.delete_many({"source": path[0], "type": target})
-        elif len(path) == 2: questions_col.delete_one({"source": path[0], "type": path[1], "chapter": target})
+        elif len(path) == 2: questions_col.delete_many({"source": path[0], "type": path[1], "chapter": target})  # Saare parts
+        bump_bank_version()
         return jsonify({"status": "deleted"})
     except: return jsonify({"error": "DB Error"})
 
@@ -525,50 +2192,613 @@ def delete_item():
 
 
 
+# --- ROOM STATE BACKENDS ---
+# Room ka chhota JSON state aur uske questions alag rakhe jaate hain. Memory backend ek
+# process ke liye hai; ROOM_BACKEND=redis par kai gunicorn workers / instances ek hi
+# room share karte hain aur emits SocketIO message queue se sab workers tak jaate hain.
+# Local multi-worker test: `redis-server` chalao, phir do alag PORT par
+# `ROOM_BACKEND=redis gunicorn -k eventlet -w 1 -b :500X quiz:app`. Sirf ek process me
+# bina Redis ke: REDIS_URL=fakeredis://
+# Har badlaav mutate(room_id, fn) se hota hai: fn sirf room dict badle aur result lautaye,
+# emit bahar karo (Redis par conflict hone par fn dobara chal sakta hai).
+ROOM_STORE_TTL = 6 * 3600  # Redis me chhoota hua room itni der baad apne aap hatega
+
+class MemoryRoomStore:
+    """Process-local room state (default, single worker)."""
+
+    def __init__(self):
+        self.rooms, self.questions, self.sids = {}, {}, {}
+        self._lock = threading.RLock()
+
+    def create(self, room_id, room, questions):
+        with self._lock:
+            if room_id in self.rooms: return False
+            self.rooms[room_id], self.questions[room_id] = room, list(questions)
+            return True
+
+    def get(self, room_id):
+        with self._lock:
+            room = self.rooms.get(room_id)
+            return copy.deepcopy(room) if room else None
+
+    def mutate(self, room_id, fn):
+        with self._lock:
+            room = self.rooms.get(room_id)
+            return None if room is None else fn(room)
+
+    def delete(self, room_id):
+        with self._lock:
+            self.rooms.pop(room_id, None)
+            self.questions.pop(room_id, None)
+
+    def ids(self):
+        with self._lock: return list(self.rooms)
+
+    def question(self, room_id, idx):
+        qs = self.questions.get(room_id) or []
+        return qs[idx] if isinstance(idx, int) and 0 <= idx < len(qs) else None
+
+    def drop_questions(self, room_id):
+        self.questions.pop(room_id, None)
+
+    def bind_sid(self, sid, room_id):
+        self.sids[sid] = room_id
+
+    def unbind_sid(self, sid):
+        return self.sids.pop(sid, None)
+
+    def room_of_sid(self, sid):
+        return self.sids.get(sid)
+
+    def sid_count(self):
+        return len(self.sids)
+
+class RedisRoomStore:
+    """Room state in Redis (room:<id> JSON, qs:<id> list, sid:<sid> key) for multi-node battles."""
+
+    def __init__(self, client, prefix="neet:"):
+        from redis.exceptions import WatchError
+        self.r, self.prefix, self._watch_error = client, prefix, WatchError
+
+    def _k(self, *parts):
+        return self.prefix + ":".join(parts)
+
+    def create(self, room_id, room, questions):
+        if not self.r.set(self._k("room", room_id), json.dumps(room), nx=True, ex=ROOM_STORE_TTL): return False
+        pipe = self.r.pipeline()
+        if questions:
+            pipe.rpush(self._k("qs", room_id), *[json.dumps(q, default=str) for q in questions])
+            pipe.expire(self._k("qs", room_id), ROOM_STORE_TTL)
+        pipe.sadd(self._k("rooms"), room_id)
+        pipe.execute()
+        return True
+
+    def get(self, room_id):
+        raw = self.r.get(self._k("room", room_id))
+        return json.loads(raw) if raw else None
+
+    def mutate(self, room_id, fn):
+        key = self._k("room", room_id)
+        with self.r.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    if raw is None:
+                        pipe.unwatch()
+                        return None
+                    room = json.loads(raw)
+                    result = fn(room)
+                    pipe.multi()
+                    pipe.set(key, json.dumps(room), ex=ROOM_STORE_TTL)
+                    pipe.execute()
+                    return result
+                except self._watch_error:
+                    continue  # Kisi aur worker ne beech me badla, dobara try
+
+    def delete(self, room_id):
+        self.r.delete(self._k("room", room_id), self._k("qs", room_id))
+        self.r.srem(self._k("rooms"), room_id)
+
+    def ids(self):
+        return list(self.r.smembers(self._k("rooms")))
+
+    def question(self, room_id, idx):
+        if not isinstance(idx, int) or idx < 0: return None
+        raw = self.r.lindex(self._k("qs", room_id), idx)
+        return json.loads(raw) if raw else None
+
+    def drop_questions(self, room_id):
+        self.r.delete(self._k("qs", room_id))
+
+    def bind_sid(self, sid, room_id):
+        self.r.set(self._k("sid", sid), room_id, ex=ROOM_STORE_TTL)
+        self.r.sadd(self._k("sids"), sid)
+
+    def unbind_sid(self, sid):
+        pipe = self.r.pipeline()
+        pipe.get(self._k("sid", sid)); pipe.delete(self._k("sid", sid)); pipe.srem(self._k("sids"), sid)
+        return pipe.execute()[0]
+
+    def room_of_sid(self, sid):
+        return self.r.get(self._k("sid", sid))
+
+    def sid_count(self):
+        return self.r.scard(self._k("sids"))
+
+def make_room_store():
+    if ROOM_BACKEND != "redis": return MemoryRoomStore()
+    if REDIS_URL.startswith("fakeredis://"):
+        import fakeredis  # Sirf local testing (ek process) ke liye
+        return RedisRoomStore(fakeredis.FakeRedis(decode_responses=True))
+    import redis
+    return RedisRoomStore(redis.Redis.from_url(REDIS_URL, decode_responses=True))
+
+# --- ROOM MANAGER (sid -> room index, TTL reaper, reconnect grace) ---
+ROOM_CODE_LEN = 5
+ROOM_IDLE_TTL = int(os.getenv("ROOM_IDLE_TTL", 900))        # Lobby / game me itni der koi activity nahi to band
+ROOM_FINISHED_TTL = int(os.getenv("ROOM_FINISHED_TTL", 120)) # Khatam room kitni der rakhna (rematch/result ke liye)
+RECONNECT_GRACE = int(os.getenv("RECONNECT_GRACE", 20))     # Disconnect ke baad wapas aane ka time
+REAPER_SECS = 30
+
+class RoomManager:
+    def __init__(self, store):
+        self.store = store
+        self._reaper_started = False
+        self.counts = {"created": 0, "reaped": 0}
+
+    def create(self, room, questions, sid):
+        # Collision check (store.create atomic hai); bahut bhar jaye to code ek letter lamba
+        length = ROOM_CODE_LEN
+        room["touched"] = time.time()
+        room["q_bytes"] = len(json.dumps(questions, default=str))
+        for attempt in range(100):
+            room_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+            if self.store.create(room_id, room, questions): break
+            if attempt % 10 == 9: length += 1
+        else:
+            raise RuntimeError("No free room code")  # Live room overwrite nahi karna
+        self.store.bind_sid(sid, room_id)
+        self.counts["created"] += 1
+        if not self._reaper_started:
+            self._reaper_started = True
+            socketio.start_background_task(self._reaper)
+        return room_id
+
+    def get(self, room_id):
+        return self.store.get(room_id) if room_id else None
+
+    def mutate(self, room_id, fn):
+        return self.store.mutate(room_id, fn) if room_id else None
+
+    def bind(self, sid, room_id):
+        self.store.bind_sid(sid, room_id)
+
+    def unbind(self, sid):
+        return self.store.unbind_sid(sid)
+
+    def remove(self, room_id):
+        room = self.store.get(room_id)
+        self.store.delete(room_id)
+        for slot in ("p1", "p2"):
+            if room and room[slot] and room[slot]["sid"] and self.store.room_of_sid(room[slot]["sid"]) == room_id:
+                self.store.unbind_sid(room[slot]["sid"])
+
+    def _reaper(self):
+        while True:
+            socketio.sleep(REAPER_SECS)
+            try: self.reap()
+            except Exception as e: print(f"Room reaper error: {e}")
+
+    def reap(self):
+        now = time.time()
+        for room_id in self.store.ids():
+            room = self.store.get(room_id)
+            if not room:
+                self.store.delete(room_id)
+                continue
+            if room["state"] == "finished":
+                expired = now - room.get("finished_at", now) > ROOM_FINISHED_TTL
+            else:
+                expired = now - room["touched"] > ROOM_IDLE_TTL
+                if expired:
+                    finish_battle(room_id, "idle")
+                    socketio.emit('player_left', {"msg": "Room closed due to inactivity."}, to=room_id)
+            if expired:
+                self.remove(room_id)
+                self.counts["reaped"] += 1
+
+    def gauges(self):
+        states, q_bytes, ids = {}, 0, self.store.ids()
+        for room_id in ids:
+            room = self.store.get(room_id)
+            if not room: continue
+            states[room["state"]] = states.get(room["state"], 0) + 1
+            q_bytes += room.get("q_bytes", 0)
+        return {"rooms": len(ids), "sids": self.store.sid_count(), "states": states,
+                "question_bytes": q_bytes, "backend": ROOM_BACKEND, **self.counts}
+
+room_mgr = RoomManager(make_room_store())
+
+def expire_disconnected(room_id, slot, since):
+    # Grace period ke baad bhi wapas nahi aaya to match khatam
+    socketio.sleep(RECONNECT_GRACE)
+    room = room_mgr.get(room_id)
+    if not room or room["state"] == "finished" or not room[slot] or room[slot].get("disconnected_at") != since: return
+    finish_battle(room_id, "disconnect")
+    socketio.emit('player_left', {"msg": "Opponent disconnected. Match ended."}, to=room_id)
+
+BATTLE_REVEAL_SECS = 2     # Answer dikhane ke baad agle question se pehle ka gap
+BATTLE_GRACE_SECS = 0.5    # Network delay ke liye deadline ke baad thoda sa chhoot
+BATTLE_MAX_QUESTIONS = 500
+
+def new_player(uid, name, sid):
+    # token sirf usi socket ko milta hai; reconnect par seat wapas isi se (uid payload me koi bhi bhej sakta hai)
+    return {"id": str(uid), "name": name, "score": 0, "sid": sid, "token": os.urandom(8).hex()}
+
+def player_slot(room, sid):
+    if room["p1"] and room["p1"]["sid"] == sid: return "p1"
+    if room["p2"] and room["p2"]["sid"] == sid: return "p2"
+    return None
+
+def battle_scores(room):
+    return {"p1_score": room["p1"]["score"], "p2_score": room["p2"]["score"] if room["p2"] else 0}
+
+def public_question(q, idx, room):
+    # Answer kabhi client ko pehle nahi jaata
+    return {"idx": idx, "total": room["total"], "id": q.get('id'), "q": q.get('q'), "opts": q.get('opts', []),
+            "diff": q.get('diff'), "timer": room["timer"]}
+
+def run_battle(room_id):
+    """Server-side game loop: ek question bhejo, timer chalao, score karo, aage badho."""
+    room = room_mgr.get(room_id)
+    if not room: return
+    for idx in range(room["total"]):
+        q = room_mgr.store.question(room_id, idx)
+
+        def open_round(room):
+            if room["state"] != "playing": return None
+            room["q_idx"], room["answers"] = idx, {}
+            room["deadline"] = room["touched"] = time.time()
+            room["deadline"] += room["timer"]
+            return copy.deepcopy(room)
+
+        room = room_mgr.mutate(room_id, open_round) if q else None
+        if not room: return
+        socketio.emit('battle_question', public_question(q, idx, room), to=room_id)
+        # Dono ne answer kar diya ya time khatam - jo pehle ho
+        while True:
+            room = room_mgr.get(room_id)
+            if not room or room["state"] != "playing": return
+            if len(room["answers"]) >= 2 or time.time() >= room["deadline"] + BATTLE_GRACE_SECS: break
+            socketio.sleep(0.2)
+
+        def close_round(room):
+            if room["state"] != "playing" or room["q_idx"] != idx: return None
+            room["q_idx"] = -1  # Is round ke late answers reject
+            return copy.deepcopy(room)
+
+        room = room_mgr.mutate(room_id, close_round)
+        if not room: return
+        socketio.emit('question_result', dict(battle_scores(room), idx=idx, ans=q.get('ans'),
+                                              answers={slot: a["choice"] for slot, a in room["answers"].items()}), to=room_id)
+        socketio.sleep(BATTLE_REVEAL_SECS)
+    finish_battle(room_id, "completed")
+
+def finish_battle(room_id, reason):
+    def close(room):
+        if room["state"] == "finished": return None
+        was_playing = room["state"] == "playing"
+        room["state"], room["finished_at"], room["q_bytes"] = "finished", time.time(), 0
+        return dict(copy.deepcopy(room), was_playing=was_playing)
+
+    room = room_mgr.mutate(room_id, close)
+    if not room: return
+    room_mgr.store.drop_questions(room_id)  # Memory turant free, room sirf result ke liye bacha
+    if reason == "completed":
+        socketio.emit('battle_over', battle_scores(room), to=room_id)
+    if room["was_playing"] and db_connected and room["p2"]:
+        # Server ka score hi final hai, isliye result save karna safe hai
+        p1, p2 = room["p1"], room["p2"]
+        winner = p1["id"] if p1["score"] > p2["score"] else (p2["id"] if p2["score"] > p1["score"] else None)
+        try:
+            battles_col.insert_one({"room": room_id, "ts": time.time(), "reason": reason, "winner": winner,
+                                    "questions": room["total"], "timer": room["timer"],
+                                    "p1": {k: p1[k] for k in ("id", "name", "score")},
+                                    "p2": {k: p2[k] for k in ("id", "name", "score")}})
+        except Exception as e:
+            print(f"Battle save error: {e}")
+
+BATTLE_MAX_CHAPTERS = 50
+
 @socketio.on('create_room')
 def handle_create(data):
-    room_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
-    ROOMS[room_id] = {
-        "host": data['uid'],
-        "p1": {"id": data['uid'], "name": data['name'], "score": 0, "sid": request.sid},
+    # Host sirf chapters + count bhejta hai; questions aur answer key server bank se nikalta hai,
+    # warna host apne client me `ans` badal kar result fix kar sakta tha
+    keys = [tuple(str(x) for x in c) for c in (data.get('chapters') or [])[:BATTLE_MAX_CHAPTERS]
+            if isinstance(c, (list, tuple)) and len(c) == 3]
+    count = max(1, min(int(data.get('count') or 20), BATTLE_MAX_QUESTIONS))
+    questions = sample_questions(keys, count) if db_connected and keys else []
+    if not questions:
+        emit('error', {"msg": "Is chapter me questions nahi hain!"}, to=request.sid)
+        return
+    room = {
+        "host": str(data['uid']),
+        "p1": new_player(data['uid'], data['name'], request.sid),
         "p2": None,
-        "questions": data.get('questions', []), # Host ke custom questions
-        "timer": data.get('timer', 30), # Host ka custom timer
-        "answered": set() # Anti-crash ke liye
+        "total": len(questions),
+        "timer": max(5, min(int(data.get('timer') or 30), 300)), # Host ka custom timer
+        "state": "lobby",
+        "q_idx": -1,
+        "answers": {},
+        "deadline": 0
     }
+    try:
+        room_id = room_mgr.create(room, questions, request.sid)
+    except RuntimeError:
+        emit('error', {"msg": "Server busy, dobara try karo!"}, to=request.sid)
+        return
     join_room(room_id)
-    emit('room_created', {"room_id": room_id}, to=request.sid)
+    emit('room_created', {"room_id": room_id, "token": room["p1"]["token"]}, to=request.sid)
 
 @socketio.on('join_room_request')
 def handle_join(data):
     room_id = data['room_id']
-    if room_id in ROOMS:
-        if ROOMS[room_id]["p2"] is None:
-            ROOMS[room_id]["p2"] = {"id": data['uid'], "name": data['name'], "score": 0, "sid": request.sid}
-            join_room(room_id)
-            emit('player_joined', {"p1": ROOMS[room_id]["p1"]["name"], "p2": data['name']}, room=room_id)
-        else:
-            emit('error', {"msg": "Room is Full!"}, to=request.sid)
+    sid = request.sid
+
+    def seat(room):
+        if room["p2"] is not None or room["state"] != "lobby": return {"full": True}
+        room["p2"] = new_player(data['uid'], data['name'], sid)
+        room["touched"] = time.time()
+        return {"p1": room["p1"]["name"], "token": room["p2"]["token"]}
+
+    res = room_mgr.mutate(room_id, seat)
+    if res is None:
+        emit('error', {"msg": "Invalid Room Code!"}, to=sid)
+    elif res.get("full"):
+        emit('error', {"msg": "Room is Full!"}, to=sid)
     else:
-        emit('error', {"msg": "Invalid Room Code!"}, to=request.sid)
+        room_mgr.bind(sid, room_id)
+        join_room(room_id)
+        emit('seat_token', {"room_id": room_id, "token": res["token"]}, to=sid)
+        emit('player_joined', {"p1": res["p1"], "p2": data['name']}, room=room_id)
 
 @socketio.on('kick_player')
 def handle_kick(data):
     room_id = data['room_id']
-    uid = data['uid']
-    if room_id in ROOMS and ROOMS[room_id]['host'] == uid:
-        if ROOMS[room_id]["p2"]:
-            p2_sid = ROOMS[room_id]["p2"]["sid"]
-            ROOMS[room_id]["p2"] = None
-            emit('kicked', {"msg": "Host removed you from the room"}, to=p2_sid)
-            leave_room(room_id, sid=p2_sid)
-            emit('player_joined', {"p1": ROOMS[room_id]["p1"]["name"], "p2": None}, room=room_id)
+    uid = str(data['uid'])
+
+    def kick(room):
+        if room['host'] != uid or room["state"] != "lobby" or not room["p2"]: return None
+        p2_sid, room["p2"] = room["p2"]["sid"], None
+        return {"sid": p2_sid, "p1": room["p1"]["name"]}
+
+    res = room_mgr.mutate(room_id, kick)
+    if res:
+        room_mgr.unbind(res["sid"])
+        emit('kicked', {"msg": "Host removed you from the room"}, to=res["sid"])
+        leave_room(room_id, sid=res["sid"])
+        emit('player_joined', {"p1": res["p1"], "p2": None}, room=room_id)
 
 @socketio.on('start_game')
 def handle_start(data):
     room_id = data['room_id']
-    if room_id in ROOMS:
-        emit('game_started', {"questions": ROOMS[room_id]["questions"], "timer": ROOMS[room_id]["timer"]}, room=room_id)
+    sid = request.sid
+
+    def start(room):
+        if room["state"] != "lobby" or player_slot(room, sid) != "p1": return None  # Sirf host start kare
+        if not room["p2"] or not room["total"]: return {"error": True}
+        room["state"], room["touched"] = "playing", time.time()
+        room["p1"]["score"] = room["p2"]["score"] = 0
+        return {"total": room["total"], "timer": room["timer"]}
+
+    res = room_mgr.mutate(room_id, start)
+    if not res: return
+    if res.get("error"):
+        emit('error', {"msg": "Opponent ya questions missing!"}, to=sid)
+        return
+    # Poore questions nahi, sirf count + timer; questions ek ek karke aayenge
+    emit('game_started', res, room=room_id)
+    socketio.start_background_task(run_battle, room_id)
+
+@socketio.on('submit_answer')
+def handle_answer(data):
+    room_id, idx, sid, now = data.get('room_id'), data.get('idx'), request.sid, time.time()
+    q = room_mgr.store.question(room_id, idx) if room_id else None
+    if not q: return
+    choice = data.get('choice', -1)
+    correct = choice == q.get('ans')
+
+    def answer(room):
+        slot = player_slot(room, sid)
+        # Purane question ka, dobara, ya deadline ke baad aaya answer ignore
+        if room["state"] != "playing" or not slot or idx != room["q_idx"] or slot in room["answers"]: return None
+        if now > room["deadline"] + BATTLE_GRACE_SECS: return None
+        room["answers"][slot] = {"choice": choice, "t": now}
+        room["touched"] = now
+        if choice != -1: room[slot]["score"] += 4 if correct else -1
+        return battle_scores(room)
+
+    scores = room_mgr.mutate(room_id, answer)
+    if not scores: return
+    # Sahi answer round band hone par hi (question_result) - pehle bhejna opponent ko leak kar sakta hai
+    emit('answer_result', {"idx": idx, "choice": choice, "correct": correct}, to=sid)
+    emit('opponent_update', scores, room=room_id)
+
+
+
+
+# --- MATCHMAKING (Random Opponent) ---
+# Queue (source, type, chapter) ke hisaab se alag pools; har pool grade se sorted list hai.
+# Join par bisect se sirf padosi dekhe jaate hain (O(log n)); scheduler har tick me
+# intezaar karne walon ki tolerance badhata hai aur bache hue padosiyon ko jodta hai.
+# Queue process-local hai: kai workers par sirf same worker ke players match honge.
+MATCH_TICK_SECS = 1
+MATCH_BASE_TOLERANCE = 1      # Grade ka farak jo turant chalega
+MATCH_WIDEN_PER_SEC = 0.25    # Har second intezaar par tolerance kitni badhe
+MATCH_MAX_WAIT = 120
+MATCH_QUESTIONS = 10
+MATCH_WAIT_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120)
+
+class Matchmaker:
+    def __init__(self):
+        self.pools = {}    # key -> sorted [(grade, joined, sid)]
+        self.entries = {}  # sid -> entry
+        self._lock = threading.Lock()
+        self._started = False
+        self.wait_hist = [0] * (len(MATCH_WAIT_BUCKETS) + 1)
+        self.counts = {"matched": 0, "timeouts": 0, "cancelled": 0, "wait_sum": 0.0}
+
+    def join(self, entry):
+        with self._lock:
+            self._remove(entry["sid"])
+            self.entries[entry["sid"]] = entry
+            pool = self.pools.setdefault(entry["key"], [])
+            bisect.insort(pool, (entry["grade"], entry["joined"], entry["sid"]))
+            pair = self._pair_neighbour(pool, entry)
+            if not self._started:
+                self._started = True
+                socketio.start_background_task(self._loop)
+        return pair
+
+    def leave(self, sid):
+        with self._lock:
+            if self._remove(sid): self.counts["cancelled"] += 1
+
+    def _remove(self, sid):
+        entry = self.entries.pop(sid, None)
+        if not entry: return None
+        pool = self.pools.get(entry["key"], [])
+        item = (entry["grade"], entry["joined"], sid)
+        i = bisect.bisect_left(pool, item)
+        if i < len(pool) and pool[i] == item: pool.pop(i)
+        if not pool: self.pools.pop(entry["key"], None)
+        return entry
+
+    def _tolerance(self, entry, now):
+        return MATCH_BASE_TOLERANCE + MATCH_WIDEN_PER_SEC * (now - entry["joined"])
+
+    def _fits(self, a, b, now):
+        if a["uid"] == b["uid"]: return False  # Same user do tabs se khud se na lade
+        return abs(a["grade"] - b["grade"]) <= max(self._tolerance(a, now), self._tolerance(b, now))
+
+    def _pair_neighbour(self, pool, entry):
+        # Naye player ke dono padosi (grade me sabse kareeb) hi candidate hain
+        now = time.time()
+        i = bisect.bisect_left(pool, (entry["grade"], entry["joined"], entry["sid"]))
+        best = None
+        for j in (i - 1, i + 1):
+            if 0 <= j < len(pool):
+                other = self.entries[pool[j][2]]
+                if self._fits(entry, other, now) and (best is None or abs(other["grade"] - entry["grade"]) < abs(best["grade"] - entry["grade"])):
+                    best = other
+        if not best: return None
+        return self._take(entry, best, now)
+
+    def _take(self, a, b, now):
+        for e in (a, b):
+            self._remove(e["sid"])
+            wait = now - e["joined"]
+            self.wait_hist[bisect.bisect_left(MATCH_WAIT_BUCKETS, wait)] += 1
+            self.counts["wait_sum"] += wait
+        self.counts["matched"] += 2
+        # Jo pehle aaya wo host
+        return (a, b) if a["joined"] <= b["joined"] else (b, a)
+
+    def tick(self):
+        now, pairs, expired = time.time(), [], []
+        with self._lock:
+            for key in list(self.pools):
+                pool = list(self.pools.get(key, []))
+                i = 0
+                while i < len(pool) - 1:
+                    a, b = self.entries.get(pool[i][2]), self.entries.get(pool[i + 1][2])
+                    if a and b and self._fits(a, b, now):
+                        pairs.append(self._take(a, b, now)); i += 2
+                    else:
+                        i += 1
+            for sid, e in list(self.entries.items()):
+                if now - e["joined"] > MATCH_MAX_WAIT:
+                    self._remove(sid); expired.append(sid)
+                    self.counts["timeouts"] += 1
+        return pairs, expired
+
+    def _loop(self):
+        while True:
+            socketio.sleep(MATCH_TICK_SECS)
+            try:
+                pairs, expired = self.tick()
+                for host, guest in pairs: start_matched_battle(host, guest)
+                for sid in expired: socketio.emit('match_timeout', {"msg": "Koi opponent nahi mila, dobara try karo!"}, to=sid)
+            except Exception as e:
+                print(f"Matchmaking error: {e}")
+
+    def gauges(self):
+        with self._lock:
+            waiting = len(self.entries)
+            oldest = max((time.time() - e["joined"] for e in self.entries.values()), default=0)
+        return {"waiting": waiting, "pools": len(self.pools), "oldest_wait": round(oldest, 1),
+                "wait_hist": dict(zip([f"<={b}s" for b in MATCH_WAIT_BUCKETS] + ["+Inf"], self.wait_hist)), **self.counts}
+
+matchmaker = Matchmaker()
+
+def sample_questions(keys, size):
+    """Random `size` questions (with answers) from the given (source, type, chapter) keys."""
+    match = {"$or": [{"source": s, "type": t, "chapter": c} for s, t, c in keys]}
+    pipeline = [{"$match": match},
+                {"$project": {"_id": 0, "item": CHAPTER_ITEMS}}, {"$unwind": "$item"}, {"$sample": {"size": size}}]
+    return resolve_questions([row['item'] for row in questions_col.aggregate(pipeline)])
+
+def start_matched_battle(host, guest):
+    source, typ, chapter = host["key"]
+    questions = sample_questions([(source, typ, chapter)], MATCH_QUESTIONS) if db_connected else []
+    if not questions:
+        for e in (host, guest): socketio.emit('error', {"msg": "Is chapter me questions nahi hain!"}, to=e["sid"])
+        return
+    room = {
+        "host": host["uid"],
+        "p1": new_player(host["uid"], host["name"], host["sid"]),
+        "p2": new_player(guest["uid"], guest["name"], guest["sid"]),
+        "total": len(questions),
+        "timer": host["timer"],
+        "state": "playing",
+        "q_idx": -1,
+        "answers": {},
+        "deadline": 0,
+        "matched": True
+    }
+    try:
+        room_id = room_mgr.create(room, questions, host["sid"])
+    except RuntimeError:
+        for e in (host, guest): socketio.emit('error', {"msg": "Server busy, dobara try karo!"}, to=e["sid"])
+        return
+    room_mgr.bind(guest["sid"], room_id)
+    for e, slot, opp in ((host, "p1", guest), (guest, "p2", host)):
+        socketio.server.enter_room(e["sid"], room_id, namespace='/')
+        socketio.emit('match_found', {"room_id": room_id, "is_host": slot == "p1", "opponent": opp["name"],
+                                      "token": room[slot]["token"]}, to=e["sid"])
+    socketio.emit('game_started', {"total": room["total"], "timer": room["timer"]}, to=room_id)
+    socketio.start_background_task(run_battle, room_id)
+
+@socketio.on('find_match')
+def handle_find_match(data):
+    uid = str(data['uid'])
+    grade = 0
+    if data.get('by_grade', True) and db_connected:
+        user = users_col.find_one({"_id": uid}, {"xp": 1})
+        grade = calculate_grade_stats((user or {}).get('xp', 0))['grade']
+    entry = {"sid": request.sid, "uid": uid, "name": data['name'], "grade": grade, "joined": time.time(),
+             "key": (data['source'], data['type'], data['chapter']),
+             "timer": max(5, min(int(data.get('timer') or 30), 300))}
+    pair = matchmaker.join(entry)
+    if pair:
+        start_matched_battle(*pair)
+    else:
+        emit('match_waiting', {"grade": grade}, to=request.sid)
+
+@socketio.on('cancel_match')
+def handle_cancel_match(data=None):
+    matchmaker.leave(request.sid)
 
 
 
@@ -576,46 +2806,322 @@ def handle_start(data):
 # --- 1v1 END BATTLE LOGIC ---
 @socketio.on('request_end_battle')
 def handle_end_req(data):
-    room_id = data['room_id']
-    uid = data['uid'] # Jisne request ki
-    name = data['name']
+    room_id, sid = data.get('room_id'), request.sid
+
+    def ask(room):
+        # Request room state me (kisne maanga), taaki jawab sirf doosra player de sake
+        slot = player_slot(room, sid)
+        if room["state"] != "playing" or not slot: return None
+        room["end_req"] = slot
+        return {"name": room[slot]["name"], "uid": room[slot]["id"]}
+
+    res = room_mgr.mutate(room_id, ask)
+    if not res: return
     # Saamne wale player ko prompt bhejo
-    emit('end_battle_prompt', {"msg": f"{name} wants to end the match. Accept?", "by": uid}, room=room_id, include_self=False)
+    emit('end_battle_prompt', {"msg": f"{res['name']} wants to end the match. Accept?", "by": res["uid"]},
+         room=room_id, include_self=False)
 
 @socketio.on('respond_end_battle')
 def handle_end_res(data):
-    room_id = data['room_id']
-    accepted = data['accepted']
+    room_id, sid, accepted = data.get('room_id'), request.sid, bool(data.get('accepted'))
+
+    def respond(room):
+        slot, asked = player_slot(room, sid), room.get("end_req")
+        if room["state"] != "playing" or not slot or not asked or asked == slot: return None
+        room["end_req"] = None
+        return {"requester": room[asked]["sid"]}
+
+    res = room_mgr.mutate(room_id, respond)
+    if not res: return
     if accepted:
+        finish_battle(room_id, "mutual_end")
         emit('game_over_early', {"msg": "Match ended by mutual agreement"}, room=room_id)
-    else:
-        emit('error', {"msg": "Opponent refused to end the match"}, to=request.sid)
+    elif res["requester"]:
+        emit('error', {"msg": "Opponent refused to end the match"}, to=res["requester"])
 
-# --- DISCONNECT LOGIC ---
-@socketio.on('disconnect')
-def handle_disconnect():
-    for room_id, room in list(ROOMS.items()):
-        if room["p1"]["sid"] == request.sid or (room["p2"] and room["p2"]["sid"] == request.sid):
-            emit('player_left', {"msg": "Opponent disconnected. Match ended."}, room=room_id)
-            # Optional: ROOMS.pop(room_id) # Room clean kar sakte hain
+# --- DISCONNECT / RECONNECT LOGIC ---
+_connected = {"sids": 0}  # Is worker ke live sockets (room me hon ya nahi), /metrics ke liye
+_connected_lock = threading.Lock()
 
-      
+@socketio.on('connect')
+def handle_connect(auth=None):
+    with _connected_lock: _connected["sids"] += 1
+
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):  # python-socketio naye versions me reason bhejta hai
+    with _connected_lock: _connected["sids"] -= 1
+    sid = request.sid
+    matchmaker.leave(sid)
+    room_id = room_mgr.unbind(sid)
+    if not room_id: return
+
+    def drop(room):
+        slot = player_slot(room, sid)
+        if room["state"] == "finished" or not slot: return None
+        if room["state"] == "lobby" and slot == "p2":
+            room["p2"] = None
+            return {"lobby": True, "p1": room["p1"]["name"]}
+        room[slot]["sid"], room[slot]["disconnected_at"] = None, time.time()
+        return {"slot": slot, "since": room[slot]["disconnected_at"]}
+
+    res = room_mgr.mutate(room_id, drop)
+    if not res: return
+    if res.get("lobby"):
+        # Lobby se guest gaya: seat khali, host wait kare
+        emit('player_joined', {"p1": res["p1"], "p2": None}, room=room_id)
+        return
+    # Turant khatam nahi, RECONNECT_GRACE tak wapas aane ka mauka
+    emit('opponent_disconnected', {"grace": RECONNECT_GRACE}, room=room_id)
+    socketio.start_background_task(expire_disconnected, room_id, res["slot"], res["since"])
+
+@socketio.on('rejoin_room')
+def handle_rejoin(data):
+    room_id, token, sid = data.get('room_id'), data.get('token'), request.sid
+
+    def rejoin(room):
+        if room["state"] == "finished" or not token: return None
+        # Seat sirf usi client ko jiske paas us seat ka token hai
+        slot = next((k for k in ("p1", "p2") if room[k] and room[k]["sid"] is None
+                     and hmac.compare_digest(room[k].get("token", ""), str(token))), None)
+        if not slot: return None
+        room[slot]["sid"], room["touched"] = sid, time.time()
+        room[slot].pop("disconnected_at", None)
+        return dict(copy.deepcopy(room), slot=slot)
+
+    room = room_mgr.mutate(room_id, rejoin)
+    if not room:
+        emit('rejoin_failed', {"msg": "Match already ended."}, to=sid)
+        return
+    room_mgr.bind(sid, room_id)
+    join_room(room_id)
+    q = room_mgr.store.question(room_id, room["q_idx"]) if room["state"] == "playing" else None
+    emit('rejoined', dict(battle_scores(room), state=room["state"], is_host=room["slot"] == "p1",
+                          question=public_question(q, room["q_idx"], room) if q else None,
+                          time_left=max(0, int(room["deadline"] - time.time()))), to=sid)
+    emit('opponent_reconnected', {}, room=room_id, include_self=False)
 
 @socketio.on('game_over')
 def handle_end(data):
     room_id = data['room_id']
-    if room_id in ROOMS:
-        # Save results to DB here if needed
+    if room_mgr.get(room_id):
+        # Result server khud save karta hai (finish_battle)
         pass
-        # Clean up room after delay could be added here
 
 
 
 
+# ==========================================
+# 🚀 DEPLOYMENT (Webhook / Polling / Health)
+# ==========================================
+# Production: `RUN_MODE=web WEBHOOK_URL=https://... gunicorn -k eventlet -w 1 -b :$PORT quiz:app`
+# Telegram updates webhook route par aate hain aur ek chhote bounded pool me process
+# hote hain, HTTP/socket handlers block nahi hote. WEBHOOK_URL na ho to bot process
+# (`RUN_MODE=bot python quiz.py`) polling karta hai.
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 8))
+UPDATE_QUEUE_MAX = int(os.getenv("UPDATE_QUEUE_MAX", 200))
+READY_CACHE_SECS = 10
+
+class UpdatePool:
+    """Bounded executor for webhook updates; refuses work instead of queueing forever."""
+
+    def __init__(self, workers, max_pending):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tg-update")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.processed = self.rejected = self.errors = 0
+
+    def submit(self, update):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            return False  # Telegram 429/5xx par khud retry karega
+        self._pool.submit(self._process, update)
+        return True
+
+    def _process(self, update):
+        try:
+            bot.process_new_updates([update])
+            self.processed += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"Update error: {e}")
+        finally:
+            self._slots.release()
+
+update_pool = UpdatePool(UPDATE_WORKERS, UPDATE_QUEUE_MAX)
+ready_cache = TTLCache(READY_CACHE_SECS, max_items=4)
+
+@app.route('/telegram/webhook/<secret>', methods=['POST'])
+def telegram_webhook(secret):
+    if secret != WEBHOOK_SECRET or request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        return "forbidden", 403
+    update = telebot.types.Update.de_json(request.get_data(as_text=True))
+    if not update_pool.submit(update):
+        return "busy", 429
+    return "ok", 200
+
+@app.route('/healthz')
+def healthz():
+    # Process zinda hai; dependencies /readyz dekhta hai
+    return jsonify({"ok": True, "mode": RUN_MODE, "import_ms": round((IMPORT_SECS or 0) * 1000),
+                    "first_request_ms": round(FIRST_REQUEST_SECS * 1000) if FIRST_REQUEST_SECS else None})
+
+def dependency_status():
+    status = ready_cache.get("deps")
+    if status is None:
+        status = {}
+        try:
+            get_client().admin.command('ping')
+            status["mongo"] = True
+        except Exception:
+            status["mongo"] = False
+        try:
+            bot.get_me()
+            status["telegram"] = True
+        except Exception:
+            status["telegram"] = False
+        ready_cache.set("deps", status)
+    return status
+
+@app.route('/readyz')
+def readyz():
+    status = dependency_status() if db_connected else {"mongo": False}
+    ok = all(status.values())
+    return jsonify(dict(status, ready=ok)), (200 if ok else 503)
+
+# --- /metrics (gauges scrape ke waqt padhe jaate hain) ---
+Gauge("quiz_battle_rooms", "Live battle rooms", lambda: len(room_mgr.store.ids()))
+Gauge("quiz_socket_connected", "Connected Socket.IO clients (this worker)", lambda: _connected["sids"])
+Gauge("quiz_socket_room_sids", "Sockets bound to a battle room", lambda: room_mgr.store.sid_count())
+Gauge("quiz_matchmaking_waiting", "Players waiting for a random opponent", lambda: len(matchmaker.entries))
+Gauge("quiz_report_queue_depth", "Mistake PDFs waiting to render", lambda: report_queue.depth())
+Gauge("quiz_content_cache_bytes", "Encoded payload cache size", lambda: content_cache.size)
+Gauge("quiz_bank_version", "Question bank cache version", lambda: BANK_VERSION)
+Gauge("quiz_import_seconds", "Time to import quiz.py (cold start)", lambda: IMPORT_SECS or 0)
+Gauge("quiz_first_request_seconds", "From import start to first HTTP request", lambda: FIRST_REQUEST_SECS or 0)
+PulledCounter("quiz_webhook_updates_total", "Webhook updates by result", lambda: {
+    ("processed",): update_pool.processed, ("rejected",): update_pool.rejected, ("errors",): update_pool.errors},
+    labels=("result",))
+PulledCounter("quiz_membership_cache_total", "Membership checker events", lambda: {(k,): v for k, v in membership.counts.items()},
+              labels=("event",))
+
+def metrics_authorized():
+    if not METRICS_TOKEN: return True
+    return request.headers.get('Authorization') == f"Bearer {METRICS_TOKEN}" or request.args.get('token') == METRICS_TOKEN
+
+@app.route('/metrics')
+def metrics():
+    if not metrics_authorized(): return "forbidden", 403
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# --- Sampling profiler (PROFILER_ENABLED=1 par hi) ---
+# /debug/profile?seconds=10 har 10ms par sab threads ke stack dekhta hai aur collapsed
+# stacks (flamegraph.pl / speedscope format) lautata hai. Eventlet par sirf OS threads
+# dikhte hain, greenlets nahi - hot spot dekhna ho to RUN_MODE=bot ya threading mode me chalao.
+PROFILE_INTERVAL = 0.01
+PROFILE_MAX_SECS = 60
+IDLE_LEAVES = {"wait", "sleep", "select", "poll", "epoll", "get", "accept", "_wait_for_tstate_lock", "serve_forever"}
+_profile_lock = threading.Lock()
+
+def sample_stacks(seconds, include_idle=False):
+    """Sample every other thread's stack for `seconds`; returns {collapsed_stack: hits}."""
+    me, stacks = threading.get_ident(), {}
+    end = time.time() + seconds
+    while time.time() < end:
+        for tid, frame in sys._current_frames().items():
+            if tid == me: continue
+            if not include_idle and frame.f_code.co_name in IDLE_LEAVES: continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(parts))
+            stacks[key] = stacks.get(key, 0) + 1
+        time.sleep(PROFILE_INTERVAL)
+    return stacks
+
+@app.route('/debug/profile')
+def debug_profile():
+    if not PROFILER_ENABLED or not metrics_authorized(): return "forbidden", 403
+    if not _profile_lock.acquire(blocking=False): return "profile already running", 409
+    try:
+        seconds = min(max(1, request.args.get('seconds', 10, type=int)), PROFILE_MAX_SECS)
+        stacks = sample_stacks(seconds, include_idle=request.args.get('idle') == '1')
+    finally:
+        _profile_lock.release()
+    ranked = sorted(stacks.items(), key=lambda kv: -kv[1])
+    if request.args.get('format') == 'top':
+        # Leaf function ke hisaab se jod kar top 30
+        leaves = {}
+        for stack, n in ranked: leaves[stack.rsplit(";", 1)[-1]] = leaves.get(stack.rsplit(";", 1)[-1], 0) + n
+        body = "\n".join(f"{n:6d}  {fn}" for fn, n in sorted(leaves.items(), key=lambda kv: -kv[1])[:30])
+    else:
+        body = "\n".join(f"{stack} {n}" for stack, n in ranked)
+    return Response(body + "\n", mimetype='text/plain')
+
+def setup_webhook():
+    # Telegram ko webhook batao; fail ho to thodi der baad dobara
+    for delay in (0, 5, 15, 60):
+        time.sleep(delay)
+        try:
+            bot.remove_webhook()
+            bot.set_webhook(url=f"{WEBHOOK_URL}/telegram/webhook/{WEBHOOK_SECRET}", secret_token=WEBHOOK_SECRET,
+                            max_connections=40, drop_pending_updates=False)
+            print("✅ Webhook set")
+            return
+        except Exception as e:
+            print(f"Webhook setup error: {e}")
+
+_services_started = False
+
+def start_background_services():
+    # Mongo/Telegram ka wait request thread par nahi, sab background me (ek hi baar)
+    global _services_started
+    if _services_started: return
+    _services_started = True
+
+    def boot():
+        index_page()  # quiz.html pehle se compress ho jaye
+        if db_connected:
+            init_db()
+            if BOT_DUTIES: broadcaster.resume_pending()  # Split deploy me web process broadcast nahi chhoota
+        if WEBHOOK_URL: setup_webhook()
+    threading.Thread(target=boot, daemon=True).start()
+
+def create_app():
+    """App factory: `RUN_MODE=web gunicorn -k eventlet -w 1 'quiz:create_app()'`."""
+    start_background_services()
+    return app
+
+def run_polling():
+    # Webhook laga ho to polling 409 dega, isliye pehle hatao
+    try: bot.remove_webhook()
+    except Exception as e: print(f"Remove webhook error: {e}")
+    bot.infinity_polling(skip_pending=False)
+
+if RUN_MODE == "web":
+    # Purana `gunicorn quiz:app` bhi chale (__main__ nahi chalta); factory wala path idempotent hai
+    start_background_services()
+
+IMPORT_SECS = time.perf_counter() - _IMPORT_T0
+print(f"⏱️ quiz.py imported in {IMPORT_SECS * 1000:.0f} ms (mode={RUN_MODE})")
+
 if __name__ == "__main__":
-    # Threading hata kar SocketIO run karein
-    t = threading.Thread(target=lambda: socketio.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), allow_unsafe_werkzeug=True))
-    t.start()
-    bot.infinity_polling()
+    port = int(os.environ.get("PORT", 5000))
+    if RUN_MODE == "bot":
+        # Sirf bot process: polling + broadcasts/backups, web alag scale hota hai
+        if db_connected:
+            threading.Thread(target=init_db, daemon=True).start()
+            broadcaster.resume_pending()
+        run_polling()
+    elif RUN_MODE == "web":
+        socketio.run(app, host="0.0.0.0", port=port, allow_unsafe_werkzeug=True)
+    else:
+        # Threading hata kar SocketIO run karein
+        t = threading.Thread(target=lambda: socketio.run(app, host="0.0.0.0", port=port, allow_unsafe_werkzeug=True))
+        t.start()
+        if db_connected: threading.Thread(target=init_db, daemon=True).start()
+        broadcaster.resume_pending()
+        if WEBHOOK_URL: setup_webhook()
+        else: run_polling()
 
        